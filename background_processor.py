@@ -1,161 +1,413 @@
 import os
 import time
-import subprocess
+import hashlib
+import logging
 import uuid
+import shutil
+from concurrent.futures import as_completed
+from functools import partial
 from flask import Flask
-from models import db, Reel
+from sqlalchemy import func, select
+from models import db, Reel, ReelStageEvent, upgrade_schema
+from job_queue import (claim_next_reel, finish_reel, make_worker_id, LeaseKeeper, Backoff,
+                       wait_for_new_reel, start_notification_listener)
 from cloud_storage import CloudStorage
 from text_to_audio import text_to_speech_file
-import glob
+from pipeline import Stage, StageError, StagePipeline
+from renderer import RenderError, render_slideshow
+from image_ingest import normalize_uploads
+from checkpoint import Checkpoint
+from config import (RENDER_CONCURRENCY, TTS_CONCURRENCY, UPLOAD_CONCURRENCY, CLAIM_AHEAD,
+                    RETRY_MAX_ATTEMPTS, RETRY_BASE_SECONDS, RETRY_MAX_DELAY_SECONDS)
+from retry import NO_RETRY, RetryPolicy, TransientError, is_transient
+from log_files import log_context, setup_logging
+from metrics import STAGE_SECONDS, REELS_FINISHED, REEL_SECONDS, QUEUE_WAIT_SECONDS
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# How often each stage of a reel is tried when it fails with a transient
+# error (counted per stage, across claims). Ingest failures are bad uploads
+# and a render is only retried when ffmpeg was killed (e.g. out of memory);
+# StageError is never retried.
+STAGE_RETRY = {
+    'ingest': NO_RETRY,
+    'tts': RetryPolicy(RETRY_MAX_ATTEMPTS, RETRY_BASE_SECONDS, RETRY_MAX_DELAY_SECONDS),
+    'render': RetryPolicy(min(2, RETRY_MAX_ATTEMPTS), RETRY_BASE_SECONDS, RETRY_MAX_DELAY_SECONDS),
+    'upload': RetryPolicy(RETRY_MAX_ATTEMPTS, RETRY_BASE_SECONDS, RETRY_MAX_DELAY_SECONDS),
+}
+# Pauses after errors in the claim loop itself (e.g. the database is down)
+LOOP_RETRY = RetryPolicy(attempts=0, base_seconds=1, max_seconds=60)
 
 def create_app():
     app = Flask(__name__)
     db_url = os.getenv('DATABASE_URL', 'sqlite:///vidsnap.db')
     if db_url.startswith("postgres://"):
         db_url = db_url.replace("postgres://", "postgresql://", 1)
-    
+
     app.config['SQLALCHEMY_DATABASE_URI'] = db_url
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     db.init_app(app)
     return app
 
-def process_reels():
-    """Process pending reels in the background"""
-    print("🚀 Background Processor Starting...")
+class ReelJob:
+    """Everything the stages need to know about one claimed reel.
+
+    Jobs cross threads, so they carry plain values instead of the Reel row.
+    `events` collects the job's timeline (ReelStageEvent rows, saved with
+    the outcome); stages put exit codes and output sizes in `stage_details`.
+    `checkpoint` holds what an earlier, interrupted attempt already finished.
+    """
+    def __init__(self, reel, worker_id):
+        self.id = reel.id
+        self.reel_id = reel.reel_id
+        self.worker_id = worker_id
+        self.upload_dir = f"user_uploads/{reel.reel_id}"
+        self.checkpoint = Checkpoint(self.upload_dir)
+        self.render_profile = reel.render_profile
+        self.attempts = reel.attempts or 1
+        self.created_at = reel.created_at or datetime.utcnow()
+        self.claimed_at = time.monotonic()
+        self.events = []
+        self.stage_details = {}
+        add_stage_event(self, 'queue', self.created_at, datetime.utcnow())
+        self.image_paths = None
+        self.audio_path = None
+        self.video_path = None
+        self.poster_path = None
+        self.preview_path = None
+        self.duration = None
+        self.audio_url = None
+        self.video_url = None
+        self.thumbnail_url = None
+        self.preview_url = None
+
+def process_reels(worker_id=None):
+    """Process pending reels in the background.
+
+    Reels flow through stages with their own thread pools and bounded
+    queues: image normalization and the ffmpeg render
+    (VIDSNAP_RENDER_CONCURRENCY each), speech synthesis
+    (VIDSNAP_TTS_CONCURRENCY) and the uploads (VIDSNAP_UPLOAD_CONCURRENCY),
+    so one reel's encode overlaps the next one's TTS and the previous one's
+    upload. A reel is claimed through job_queue only when fewer than
+    VIDSNAP_RENDER_CONCURRENCY + VIDSNAP_CLAIM_AHEAD reels are waiting for
+    or in the render stage, so the fair-share claim order decides what
+    renders next and other workers can pick up the rest of the backlog.
+    When the queue is empty the worker sleeps until notify_new_reel() wakes
+    it, with backoff polling as the fallback.
+    """
+    logger.info("🚀 Background Processor Starting...")
     app = create_app()
     cloud_storage = CloudStorage()
-    
+    worker_id = worker_id or make_worker_id()
+
+    with app.app_context():
+        logger.info("🔗 Connected to Database: %s", app.config['SQLALCHEMY_DATABASE_URI'])
+        upgrade_schema()
+    logger.info("🪪 Worker id: %s (tts=%d, render=%d, upload=%d)",
+                worker_id, TTS_CONCURRENCY, RENDER_CONCURRENCY, UPLOAD_CONCURRENCY)
+
+    leases = LeaseKeeper(app, worker_id)
+    leases.start()
+    pipeline = StagePipeline(
+        [
+            Stage('ingest', prepare_images, RENDER_CONCURRENCY),
+            Stage('tts', synthesize_audio, TTS_CONCURRENCY),
+            Stage('render', render_video, RENDER_CONCURRENCY),
+            Stage('upload', partial(upload_outputs, cloud_storage=cloud_storage), UPLOAD_CONCURRENCY),
+        ],
+        on_done=partial(record_result, leases=leases),
+        on_error=partial(record_failure, leases=leases),
+        context=app.app_context,
+        on_stage=add_stage_event,
+        # Finished renders make room; uploads don't hold up the next claim
+        slots=RENDER_CONCURRENCY + CLAIM_AHEAD,
+        slot_stage='render',
+    )
+    pipeline.start()
+    start_notification_listener(app)
+    idle = Backoff()
+    errors = 0
+
     with app.app_context():
-        print(f"🔗 Connected to Database: {app.config['SQLALCHEMY_DATABASE_URI']}")
         while True:
+            pipeline.acquire_slot()
             try:
-                # Get all processing reels
-                processing_reels = Reel.query.filter_by(status='processing').all()
-                if processing_reels:
-                    print(f"📦 Found {len(processing_reels)} reels to process.")
-                
-                for reel in processing_reels:
-                    print(f"Processing reel: {reel.reel_id}")
-                    
-                    try:
-                        # Process the reel
-                        result = process_single_reel(reel, cloud_storage)
-                        
-                        if result['success']:
-                            reel.status = 'completed'
-                            reel.video_url = result['video_url']
-                            reel.thumbnail_url = result['thumbnail_url']
-                            reel.audio_url = result['audio_url']
-                            print(f"✅ Reel {reel.reel_id} status prepared: completed")
-                        else:
-                            reel.status = 'failed'
-                            print(f"❌ Reel {reel.reel_id} status prepared: failed ({result.get('error', 'Unknown error')})")
-                        
-                        try:
-                            db.session.commit()
-                            print(f"💾 Reel {reel.reel_id} committed to DB with status: {reel.status}")
-                        except Exception as commit_error:
-                            print(f"⚠️  Database commit failed for {reel.reel_id}: {commit_error}")
-                            db.session.rollback()
-                        
-                    except Exception as e:
-                        import traceback
-                        print(f"❌ Error processing reel {reel.reel_id}:")
-                        traceback.print_exc()
-                        reel.status = 'failed'
-                        db.session.commit()
-                
-                # Sleep for 10 seconds before checking again
-                time.sleep(10)
-                
+                reel = claim_next_reel(worker_id)
             except Exception as e:
-                import traceback
-                print(f"🔥 Fatal error in background processor:")
-                traceback.print_exc()
-                time.sleep(30)
+                errors += 1
+                delay = LOOP_RETRY.delay(errors)
+                logger.exception("🔥 Fatal error in background processor (retrying in %.0fs):", delay)
+                pipeline.release_slot()
+                time.sleep(delay)
+                continue
+            errors = 0
 
-def process_single_reel(reel, cloud_storage):
-    """Process a single reel"""
+            if reel is None:
+                pipeline.release_slot()
+                wait_for_new_reel(idle.next())
+                continue
+
+            idle.reset()
+            if reel.attempts > RETRY_MAX_ATTEMPTS and lost_claims(reel) >= RETRY_MAX_ATTEMPTS:
+                # Claimed again and again without an outcome: whatever it does
+                # keeps killing its workers, so stop handing it out
+                pipeline.release_slot()
+                give_up(reel, worker_id, lost_claims(reel))
+                continue
+            logger.info("Processing reel: %s", reel.reel_id, extra={'reel_id': reel.reel_id})
+            job = ReelJob(reel, worker_id)
+            QUEUE_WAIT_SECONDS.observe(job.events[0].duration_seconds)
+            leases.add(reel.id)
+            pipeline.submit(job)
+
+def add_stage_event(job, stage, started_at, finished_at, error=None):
+    """Append one stage to the job's timeline (also the pipeline's on_stage hook)"""
+    details = job.stage_details.get(stage, {})
+    job.events.append(ReelStageEvent(
+        reel_id=job.id,
+        stage=stage,
+        worker_id=job.worker_id,
+        started_at=started_at,
+        finished_at=finished_at,
+        duration_seconds=(finished_at - started_at).total_seconds(),
+        status='failed' if error else 'ok',
+        error=str(error)[:500] if error else None,
+        exit_code=details.get('exit_code'),
+        output_bytes=details.get('output_bytes'),
+    ))
+
+def lost_claims(reel):
+    """Earlier claims of the reel that ended without an outcome (the worker
+    died or lost its lease); every saved outcome has a 'total' stage event"""
+    outcomes = db.session.scalar(
+        select(func.count()).select_from(ReelStageEvent)
+        .where(ReelStageEvent.reel_id == reel.id, ReelStageEvent.stage == 'total')
+    )
+    return reel.attempts - 1 - outcomes
+
+def stage_tries(job, stage):
+    """How often `stage` has failed for this reel, the failure at hand included"""
+    earlier = db.session.scalar(
+        select(func.count()).select_from(ReelStageEvent)
+        .where(ReelStageEvent.reel_id == job.id, ReelStageEvent.stage == stage,
+               ReelStageEvent.status == 'failed')
+    )
+    return earlier + 1
+
+def give_up(reel, worker_id, lost):
+    """Move a reel whose attempts ran out without an outcome to 'dead'"""
+    last_error = f"Gave up after {lost} attempts ended without a result: {reel.last_error or 'worker lost mid-reel'}"
+    logger.error("☠️  Reel %s is dead: %s", reel.reel_id, last_error, extra={'reel_id': reel.reel_id})
+    if finish_reel(reel.id, worker_id, status='dead', next_attempt_at=None, last_error=last_error[:1000]):
+        REELS_FINISHED.labels('dead').inc()
+
+def record_result(job, leases):
+    """Pipeline callback: the reel made it through every stage"""
+    logger.info("✅ Reel %s status prepared: completed", job.reel_id)
+    save_outcome(job, leases, {
+        'status': 'completed',
+        'next_attempt_at': None,
+        'video_url': job.video_url,
+        'thumbnail_url': job.thumbnail_url,
+        'preview_url': job.preview_url,
+        'duration_seconds': job.duration,
+        'audio_url': job.audio_url,
+    })
+
+def record_failure(job, error, leases):
+    """Pipeline callback: a stage raised.
+
+    Transient errors put the reel back in the queue until the failing
+    stage's retry policy runs out, then it goes to 'dead'; anything else
+    fails it at once.
+    """
+    stage = next((event.stage for event in reversed(job.events) if event.status == 'failed'), None)
+    policy = STAGE_RETRY.get(stage, NO_RETRY)
+    last_error = f"{stage}: {error}"[:1000]
     try:
-        # Find the user upload folder
-        upload_dir = f"user_uploads/{reel.reel_id}"
-        
-        if not os.path.exists(upload_dir):
-            return {"success": False, "error": "Upload directory not found"}
-        
-        # Generate audio
-        desc_file = os.path.join(upload_dir, "desc.txt")
-        if os.path.exists(desc_file):
-            with open(desc_file, 'r') as f:
-                description = f.read().strip()
-            
-            # Generate audio
-            audio_path = text_to_speech_file(description, reel.reel_id)
-            
-            # Upload audio to cloud
-            audio_url = cloud_storage.upload_audio(audio_path)
+        tries = stage_tries(job, stage)
+    except Exception as e:
+        db.session.rollback()
+        logger.warning("⚠️  Could not count earlier %s failures of %s (%s)", stage, job.reel_id, e)
+        tries = job.attempts
+    if policy.should_retry(error, tries):
+        delay = policy.delay(tries, error)
+        logger.warning("🔁 Reel %s failed in %s (try %d/%d): %s; retrying in %.0fs",
+                       job.reel_id, stage, tries, policy.attempts, error, delay)
+        save_outcome(job, leases, {
+            'status': 'processing',
+            'next_attempt_at': datetime.utcnow() + timedelta(seconds=delay),
+            'last_error': last_error,
+        }, error, outcome='retry')
+        return
+    status = 'dead' if is_transient(error) else 'failed'
+    logger.warning("❌ Reel %s status prepared: %s (%s)", job.reel_id, status, error)
+    save_outcome(job, leases, {'status': status, 'next_attempt_at': None, 'last_error': last_error}, error)
+
+def save_outcome(job, leases, values, error=None, outcome=None):
+    leases.discard(job.id)
+    add_stage_event(job, 'total', job.created_at, datetime.utcnow(), error)
+    try:
+        with STAGE_SECONDS.labels('commit').time():
+            finished = finish_reel(job.id, job.worker_id, events=job.events, **values)
+        if finished:
+            REELS_FINISHED.labels(outcome or values['status']).inc()
+            REEL_SECONDS.observe(time.monotonic() - job.claimed_at)
+            logger.info("💾 Reel %s committed to DB with status: %s", job.reel_id, values['status'])
+        else:
+            # Our lease expired and another worker took the reel over
+            logger.warning("⚠️  Lease on %s lost; discarding this result", job.reel_id)
+    except Exception as commit_error:
+        logger.error("⚠️  Database commit failed for %s: %s", job.reel_id, commit_error)
+
+def prepare_images(job):
+    """Stage 1: fit the uploads to the reel canvas once; runs first so bad images fail before any TTS spend"""
+    if not os.path.exists(job.upload_dir):
+        raise StageError("Upload directory not found")
+    try:
+        job.image_paths = normalize_uploads(job.upload_dir)
+    except (OSError, ValueError) as e:
+        raise StageError(f"Could not read uploaded image: {e}")
+    if not job.image_paths:
+        raise StageError("No images found")
+
+def synthesize_audio(job):
+    """Stage 2: turn desc.txt into audio.mp3"""
+    desc_file = os.path.join(job.upload_dir, "desc.txt")
+    if not os.path.exists(desc_file):
+        raise StageError("Description file not found")
+    with open(desc_file, 'r') as f:
+        description = f.read().strip()
+
+    inputs = {'text': hashlib.sha256(description.encode()).hexdigest()}
+    if job.checkpoint.get('tts', **inputs) is not None:
+        job.audio_path = os.path.join(job.upload_dir, "audio.mp3")
+        logger.info("⏭️  Reel %s: narration restored from checkpoint", job.reel_id)
+    else:
+        job.audio_path = text_to_speech_file(description, job.reel_id)
+        job.checkpoint.record('tts', artifacts=[job.audio_path], **inputs)
+    job.stage_details['tts'] = {'output_bytes': os.path.getsize(job.audio_path)}
+
+def render_video(job):
+    """Stage 3: encode the images and narration into an MP4 slideshow, plus
+    the gallery poster and preview clip from the same ffmpeg run"""
+    job.video_path = os.path.join(job.upload_dir, f"{job.reel_id}.mp4")
+    # Kept out of the upload folder itself, where a re-render (e.g. after
+    # another worker reclaims the reel) would take poster.jpg for an image
+    extras_dir = os.path.join(job.upload_dir, "rendered")
+    os.makedirs(extras_dir, exist_ok=True)
+    job.poster_path = os.path.join(extras_dir, "poster.jpg")
+    job.preview_path = os.path.join(extras_dir, "preview.mp4")
+    inputs = {'profile': job.render_profile, 'frames': [os.path.basename(path) for path in job.image_paths]}
+    checkpointed = job.checkpoint.get('render', **inputs)
+    if checkpointed is not None:
+        job.duration = checkpointed['duration']
+        job.stage_details['render'] = {'exit_code': None, 'output_bytes': os.path.getsize(job.video_path)}
+        logger.info("⏭️  Reel %s: video restored from checkpoint", job.reel_id)
+        return
+    try:
+        stats = render_slideshow(job.image_paths, job.audio_path, job.video_path,
+                                 profile=job.render_profile,
+                                 poster_path=job.poster_path, preview_path=job.preview_path)
+    except RenderError as e:
+        job.stage_details['render'] = {'exit_code': e.returncode}
+        if e.returncode is not None and e.returncode < 0:
+            # Killed by a signal (the OOM killer, a redeploy), not bad input
+            raise TransientError(f"ffmpeg was killed by signal {-e.returncode}")
+        raise StageError(str(e))
+    job.duration = stats['duration']
+    job.checkpoint.record('render', {'duration': job.duration},
+                          [job.video_path, job.poster_path, job.preview_path], **inputs)
+    # A render served from the cache ran no ffmpeg, so there is no exit code
+    job.stage_details['render'] = {'exit_code': None if stats['cached'] else 0,
+                                   'output_bytes': stats['output_bytes']}
+    logger.info("🎞️  Reel %s encoded with '%s' in %ss (%d bytes)%s",
+                job.reel_id, stats['profile'], stats['encode_seconds'], stats['output_bytes'],
+                " (cached)" if stats['cached'] else "")
+
+def upload_outputs(job, cloud_storage):
+    """Stage 4: publish the video, audio, preview and poster, falling back to local static paths"""
+    outputs = {
+        'video': ('video', job.video_path),
+        'audio': ('audio', job.audio_path),
+        'preview': ('preview', job.preview_path),
+        'poster': ('poster', job.poster_path),
+    }
+    urls, pending = {}, {}
+    for name, (kind, path) in outputs.items():
+        checkpointed = job.checkpoint.get(f"upload_{name}")
+        if checkpointed is not None:
+            urls[name] = checkpointed['url']
+            logger.info("⏭️  Reel %s: %s already uploaded", job.reel_id, name)
         else:
-            return {"success": False, "error": "Description file not found"}
-        
-        # Create video using FFmpeg
-        video_path = os.path.join(upload_dir, f"{reel.reel_id}.mp4")
-        
-        # Get image files
-        image_files = glob.glob(os.path.join(upload_dir, "*.jpg")) + glob.glob(os.path.join(upload_dir, "*.jpeg")) + glob.glob(os.path.join(upload_dir, "*.png"))
-        
-        if not image_files:
-            return {"success": False, "error": "No images found"}
-        
-        # Create FFmpeg command
-        ffmpeg_cmd = [
-            'ffmpeg',
-            '-y',  # Overwrite output file
-            '-loop', '1',
-            '-i', image_files[0],  # Use first image
-            '-i', audio_path,
-            '-c:v', 'libx264',
-            '-tune', 'stillimage',
-            '-c:a', 'aac',
-            '-b:a', '192k',
-            '-pix_fmt', 'yuv420p',
-            '-shortest',
-            '-vf', 'scale=1080:1920:force_original_aspect_ratio=decrease,pad=1080:1920:(ow-iw)/2:(oh-ih)/2',
-            video_path
-        ]
-        
-        # Run FFmpeg
-        result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            return {"success": False, "error": f"FFmpeg error: {result.stderr}"}
-        
-        # Upload to cloud or use local path fallback
-        video_url = cloud_storage.upload_video(video_path)
-        audio_url = cloud_storage.upload_audio(audio_path)
-        
-        # If cloud upload is disabled, use local static paths
-        if not video_url:
-            video_url = f"/static/reels/{reel.reel_id}.mp4"
-            # Move video to static/reels if it's not already there
-            static_reels_dir = "static/reels"
-            os.makedirs(static_reels_dir, exist_ok=True)
-            import shutil
-            shutil.copy2(video_path, os.path.join(static_reels_dir, f"{reel.reel_id}.mp4"))
-            
-        if not audio_url:
-            audio_url = f"/{upload_dir}/audio.mp3"
-            
-        thumbnail_url = cloud_storage.get_thumbnail_url(video_url) if video_url and "cloudinary" in video_url else None
-        
-        return {
-            "success": True,
-            "video_url": video_url,
-            "thumbnail_url": thumbnail_url,
-            "audio_url": audio_url
-        }
-        
+            pending[cloud_storage.upload_async(kind, path)] = name
+    # Checkpoint each upload as it lands, so a crash or a failed upload
+    # leaves only the unfinished ones to redo
+    error = None
+    for future in as_completed(pending):
+        name = pending[future]
+        try:
+            urls[name] = future.result()
+        except Exception as e:
+            error = error or e
+            continue
+        if urls[name]:
+            job.checkpoint.record(f"upload_{name}", {'url': urls[name]}, [outputs[name][1]])
+    if error:
+        raise error
+    video_url = urls['video']
+    audio_url = urls['audio']
+    preview_url = urls['preview']
+    thumbnail_url = urls['poster']
+
+    # If cloud upload is disabled, use local static paths
+    static_reels_dir = "static/reels"
+    os.makedirs(static_reels_dir, exist_ok=True)
+    if not video_url:
+        video_url = f"/static/reels/{job.reel_id}.mp4"
+        # Move video to static/reels if it's not already there
+        shutil.copy2(job.video_path, os.path.join(static_reels_dir, f"{job.reel_id}.mp4"))
+
+    if not audio_url:
+        audio_url = f"/{job.upload_dir}/audio.mp3"
+
+    if not thumbnail_url:
+        thumbnail_url = f"/static/reels/{job.reel_id}.jpg"
+        shutil.copy2(job.poster_path, os.path.join(static_reels_dir, f"{job.reel_id}.jpg"))
+
+    if not preview_url:
+        preview_url = f"/static/reels/{job.reel_id}-preview.mp4"
+        shutil.copy2(job.preview_path, os.path.join(static_reels_dir, f"{job.reel_id}-preview.mp4"))
+
+    job.video_url = video_url
+    job.audio_url = audio_url
+    job.thumbnail_url = thumbnail_url
+    job.preview_url = preview_url
+    job.stage_details['upload'] = {
+        'output_bytes': sum(os.path.getsize(path) for _, path in outputs.values())
+    }
+
+def process_single_reel(reel, cloud_storage, worker_id=None):
+    """Process a single reel by running every stage inline"""
+    job = ReelJob(reel, worker_id)
+    try:
+        for stage, run in [('ingest', prepare_images), ('tts', synthesize_audio),
+                           ('render', render_video), ('upload', partial(upload_outputs, cloud_storage=cloud_storage))]:
+            with log_context(reel_id=job.reel_id, stage=stage):
+                run(job)
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+    return {
+        "success": True,
+        "video_url": job.video_url,
+        "thumbnail_url": job.thumbnail_url,
+        "preview_url": job.preview_url,
+        "audio_url": job.audio_url
+    }
+
 if __name__ == "__main__":
+    setup_logging()
     process_reels()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Benchmark the ffmpeg render stage with synthetic inputs.
+
+Runs entirely offline: images and narration are generated locally with
+ffmpeg, and only the render stage runs (no TTS, no Cloudinary). Like the
+worker, each render also writes the gallery poster and preview clip unless
+--no-extras is given. Every combination of the parameter lists is rendered,
+and one row per case is reported with wall time, ffmpeg CPU time, peak RSS
+and output size.
+
+Example:
+    python benchmark_render.py --images 1,5,20 --resolutions 1280x720,4032x3024 \\
+        --durations 15,60 --profiles fast-preview,standard --concurrency 1,4 --format csv
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from renderer import build_slideshow_command, get_profile
+
+FIELDS = [
+    'images', 'resolution', 'audio_seconds', 'profile', 'crossfade', 'concurrency', 'repeat',
+    'wall_seconds', 'cpu_seconds', 'peak_rss_mb', 'output_bytes', 'reels_per_minute',
+]
+
+
+def csv_list(cast):
+    return lambda value: [cast(item) for item in value.split(',') if item]
+
+
+def make_image(path, resolution, seed):
+    """A busy test pattern (harder to compress than a flat colour)"""
+    subprocess.run(
+        ['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', f'testsrc2=size={resolution}:rate=1',
+         '-vf', f'hue=h={seed * 37 % 360}', '-frames:v', '1', '-q:v', '3', path],
+        check=True,
+    )
+
+
+def make_audio(path, seconds):
+    """Narration stand-in in the same MP3 format ElevenLabs returns"""
+    subprocess.run(
+        ['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', 'sine=frequency=220', '-t', str(seconds),
+         '-ar', '22050', '-ac', '1', '-b:a', '32k', path],
+        check=True,
+    )
+
+
+def run_ffmpeg(cmd):
+    """Run one render and return (cpu_seconds, peak_rss_mb) for that ffmpeg process"""
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=stderr)
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        if proc.returncode != 0:
+            stderr.seek(0)
+            raise RuntimeError(f"ffmpeg failed: {stderr.read().decode(errors='replace')[-1000:]}")
+    # ru_maxrss is in kilobytes on Linux
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024
+
+
+def run_case(workdir, images, audio_path, audio_seconds, profile, crossfade, concurrency, extras=True):
+    """Render `concurrency` reels at once; returns wall time, total CPU, max RSS and output size.
+
+    `extras` adds the poster and preview outputs to each render, as the worker does.
+    """
+    results = [None] * concurrency
+    errors = []
+
+    def render(slot):
+        output = os.path.join(workdir, f'out-{slot}.mp4')
+        try:
+            extra_paths = {}
+            if extras:
+                extra_paths = {'poster_path': os.path.join(workdir, f'poster-{slot}.jpg'),
+                               'preview_path': os.path.join(workdir, f'preview-{slot}.mp4')}
+            cmd = build_slideshow_command(images, audio_path, output, audio_seconds, crossfade, profile,
+                                          **extra_paths)
+            cpu, rss = run_ffmpeg(cmd)
+            results[slot] = (cpu, rss, os.path.getsize(output))
+        except Exception as e:
+            errors.append(e)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=render, args=(slot,)) for slot in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    if errors:
+        raise errors[0]
+
+    return {
+        'wall_seconds': round(wall, 3),
+        'cpu_seconds': round(sum(r[0] for r in results), 3),
+        'peak_rss_mb': round(max(r[1] for r in results), 1),
+        'output_bytes': results[0][2],
+        'reels_per_minute': round(concurrency * 60 / wall, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the VidSnap render stage")
+    parser.add_argument('--images', type=csv_list(int), default=[1, 5, 20], help="image counts")
+    parser.add_argument('--resolutions', type=csv_list(str), default=['1280x720', '4032x3024'], help="input image sizes")
+    parser.add_argument('--durations', type=csv_list(float), default=[15], help="audio lengths in seconds")
+    parser.add_argument('--profiles', type=csv_list(str), default=['standard'], help="render profiles")
+    parser.add_argument('--crossfades', type=csv_list(float), default=[0.5], help="crossfade lengths (0 = hard cuts)")
+    parser.add_argument('--concurrency', type=csv_list(int), default=[1], help="renders run at once")
+    parser.add_argument('--repeat', type=int, default=1, help="runs per case")
+    parser.add_argument('--no-extras', dest='extras', action='store_false',
+                        help="render only the video, without the poster and preview the worker also writes")
+    parser.add_argument('--format', choices=['json', 'csv'], default='json')
+    parser.add_argument('--output', help="write the report here instead of stdout")
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory(prefix='vidsnap-bench-') as workdir:
+        print("🧪 Generating synthetic inputs...", file=sys.stderr)
+        image_sets = {}
+        for resolution in args.resolutions:
+            paths = []
+            for i in range(max(args.images)):
+                path = os.path.join(workdir, f'{resolution}-{i}.jpg')
+                make_image(path, resolution, i)
+                paths.append(path)
+            image_sets[resolution] = paths
+        audio_files = {}
+        for seconds in args.durations:
+            audio_files[seconds] = os.path.join(workdir, f'audio-{seconds}.mp3')
+            make_audio(audio_files[seconds], seconds)
+
+        cases = itertools.product(args.images, args.resolutions, args.durations, args.profiles,
+                                  args.crossfades, args.concurrency, range(1, args.repeat + 1))
+        for count, resolution, seconds, profile, crossfade, concurrency, repeat in cases:
+            # Profiles may pin their own crossfade; report what was actually rendered
+            crossfade = get_profile(profile).get('crossfade', crossfade)
+            row = {
+                'images': count, 'resolution': resolution, 'audio_seconds': seconds, 'profile': profile,
+                'crossfade': crossfade, 'concurrency': concurrency, 'repeat': repeat,
+            }
+            row.update(run_case(workdir, image_sets[resolution][:count], audio_files[seconds],
+                                seconds, profile, crossfade, concurrency, args.extras))
+            print(f"⏱️  {row}", file=sys.stderr)
+            rows.append(row)
+
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        if args.format == 'csv':
+            writer = csv.DictWriter(out, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            json.dump(rows, out, indent=2)
+            out.write('\n')
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Per-reel stage checkpoints, so a resumed reel skips the work already done.
+
+A worker killed mid-reel (a redeploy, an OOM kill) loses its lease, and the
+reel is claimed again once the lease expires. Each step that finishes is
+recorded in `checkpoint.json` in the reel's upload folder: the values it
+produced (durations, URLs) and the size of every file it left behind. The
+next worker to claim the reel reads the file and skips every step whose
+artifacts are still intact: narration ready, video encoded, video, audio,
+preview and poster uploaded.
+
+Redoing a step drops the checkpoints of the steps built on its output, so a
+re-synthesized narration is always re-encoded and re-uploaded. Image
+normalization needs no checkpoint; image_ingest already skips frames that
+are up to date.
+"""
+import json
+import os
+import threading
+
+CHECKPOINT_FILE = "checkpoint.json"
+
+# A step's artifacts feed the steps listed here; redoing it invalidates them
+DEPENDENTS = {
+    'tts': ('render', 'upload_audio'),
+    'render': ('upload_video', 'upload_preview', 'upload_poster'),
+}
+
+
+class Checkpoint:
+    def __init__(self, upload_dir):
+        self.path = os.path.join(upload_dir, CHECKPOINT_FILE)
+        self._lock = threading.Lock()
+        self.steps = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                steps = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        return steps if isinstance(steps, dict) else {}
+
+    def get(self, step, **inputs):
+        """The values recorded for `step`, or None if it has to run (again).
+
+        A checkpoint only counts if it was recorded with the same `inputs`
+        and every artifact it lists still exists with its recorded size.
+        """
+        entry = self.steps.get(step)
+        if not entry or entry.get('inputs') != inputs:
+            return None
+        for path, size in entry.get('artifacts', {}).items():
+            try:
+                if os.path.getsize(path) != size:
+                    return None
+            except OSError:
+                return None
+        return entry.get('values', {})
+
+    def record(self, step, values=None, artifacts=(), **inputs):
+        """Mark `step` done, with its output `values` and the files it wrote"""
+        entry = {
+            'inputs': inputs,
+            'values': values or {},
+            'artifacts': {path: os.path.getsize(path) for path in artifacts},
+        }
+        with self._lock:
+            for dependent in DEPENDENTS.get(step, ()):
+                self.steps.pop(dependent, None)
+            self.steps[step] = entry
+            self._save()
+
+    def _save(self):
+        # Write-then-rename, so a crash mid-write leaves the previous checkpoint
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.steps, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
@@ -1,86 +1,206 @@
 import cloudinary
 import cloudinary.uploader
 import cloudinary.api
+import cloudinary.utils
+from cloudinary.exceptions import (Error as CloudinaryError, AlreadyExists, AuthorizationRequired, BadRequest,
+                                   NotAllowed, NotFound, RateLimited)
+import functools
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.utils import secure_filename
+from config import UPLOAD_CONCURRENCY, CLOUDINARY_CHUNK_THRESHOLD_BYTES, CLOUDINARY_CHUNK_SIZE_BYTES
+from disk_cache import file_digest
+from metrics import UPLOAD_SECONDS
+from rate_limit import CLOUDINARY_LIMIT
+from retry import RetryPolicy, TransientError, is_transient
+
+# Content hashes of files uploaded by this process, so re-uploads are skipped
+UPLOAD_MEMO_SIZE = 1024
+
+# Cloudinary reports rejected requests with these; anything else it raises
+# (5xx, rate limits, socket errors, garbled responses) is worth retrying
+PERMANENT_UPLOAD_ERRORS = (AlreadyExists, AuthorizationRequired, BadRequest, NotAllowed, NotFound)
+
+
+def is_transient_upload_error(error):
+    if isinstance(error, PERMANENT_UPLOAD_ERRORS):
+        return False
+    return isinstance(error, CloudinaryError) or is_transient(error)
+
+
+def rate_limited(function):
+    """Wrap a Cloudinary SDK call to run within the shared client-side limit"""
+    @functools.wraps(function)
+    def call(*args, **kwargs):
+        with CLOUDINARY_LIMIT.slot():
+            try:
+                return function(*args, **kwargs)
+            except RateLimited:
+                CLOUDINARY_LIMIT.throttled()
+                raise
+    return call
+
+
+# Short in-process retries around each upload call
+UPLOAD_RETRY = RetryPolicy(attempts=3, base_seconds=1, max_seconds=10, retry_on=is_transient_upload_error)
 
 class CloudStorage:
     def __init__(self):
         self.cloud_name = os.getenv('CLOUDINARY_CLOUD_NAME')
         self.api_key = os.getenv('CLOUDINARY_API_KEY')
         self.api_secret = os.getenv('CLOUDINARY_API_SECRET')
+        # e.g. http://localhost:8000 to point uploads at a local stub server
+        self.upload_prefix = os.getenv('CLOUDINARY_UPLOAD_PREFIX')
+        self._uploaded = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY, thread_name_prefix="upload")
         
         if not all([self.cloud_name, self.api_key, self.api_secret]):
             print("⚠️ Cloudinary credentials not found. Using local storage fallback.")
             self.enabled = False
         else:
+            options = {'upload_prefix': self.upload_prefix} if self.upload_prefix else {}
             cloudinary.config(
                 cloud_name=self.cloud_name,
                 api_key=self.api_key,
-                api_secret=self.api_secret
+                api_secret=self.api_secret,
+                **options
+            )
+            # The SDK's shared pool keeps one keep-alive connection per host;
+            # size it for concurrent uploads so connections get reused
+            cloudinary.uploader._http = cloudinary.utils.get_http_connector(
+                cloudinary.config(), dict(cloudinary.CERT_KWARGS, maxsize=UPLOAD_CONCURRENCY)
             )
             self.enabled = True
     
+    def _upload(self, file_path, folder, resource_type, **options):
+        """Upload once per distinct content, in chunks when the file is large.
+
+        The public id is the file's content hash, so identical files map to
+        the same Cloudinary asset (overwrite=False keeps the stored copy).
+        """
+        digest = file_digest(file_path)
+        memo_key = (digest, folder, resource_type)
+        with self._lock:
+            if memo_key in self._uploaded:
+                self._uploaded.move_to_end(memo_key)
+                return self._uploaded[memo_key]
+        
+        params = dict(
+            folder=folder,
+            resource_type=resource_type,
+            public_id=digest[:32],
+            overwrite=False,
+            **options
+        )
+        if os.path.getsize(file_path) > CLOUDINARY_CHUNK_THRESHOLD_BYTES:
+            # One slot for all the chunks; they are sent one after another
+            result = UPLOAD_RETRY.call(rate_limited(cloudinary.uploader.upload_large), file_path,
+                                       chunk_size=CLOUDINARY_CHUNK_SIZE_BYTES, **params)
+        else:
+            result = UPLOAD_RETRY.call(rate_limited(cloudinary.uploader.upload), file_path, **params)
+        url = result['secure_url']
+        
+        with self._lock:
+            self._uploaded[memo_key] = url
+            if len(self._uploaded) > UPLOAD_MEMO_SIZE:
+                self._uploaded.popitem(last=False)
+        return url
+    
+    def _upload_failed(self, kind, error):
+        """Raise transient failures so the worker retries the reel later;
+        anything else falls back to local storage"""
+        if is_transient_upload_error(error):
+            raise TransientError(f"{kind.capitalize()} upload failed: {error}") from error
+        print(f"Error uploading {kind}: {error}")
+        return None
+    
     def upload_image(self, file_path, folder="vidsnap/images"):
         """Upload image to Cloudinary"""
         if not self.enabled:
             return None
         try:
-            result = cloudinary.uploader.upload(
+            return self._upload(
                 file_path,
-                folder=folder,
-                resource_type="image",
+                folder,
+                "image",
                 transformation=[
                     {"width": 1080, "height": 1920, "crop": "fill", "quality": "auto"},
                     {"format": "auto"}
                 ]
             )
-            return result['secure_url']
         except Exception as e:
-            print(f"Error uploading image: {e}")
-            return None
+            return self._upload_failed("image", e)
     
     def upload_video(self, file_path, folder="vidsnap/videos"):
         """Upload video to Cloudinary"""
         if not self.enabled:
             return None
         try:
-            result = cloudinary.uploader.upload(
+            return self._upload(
                 file_path,
-                folder=folder,
-                resource_type="video",
+                folder,
+                "video",
                 transformation=[
                     {"width": 1080, "height": 1920, "crop": "fill"},
                     {"format": "mp4", "quality": "auto"}
                 ]
             )
-            return result['secure_url']
         except Exception as e:
-            print(f"Error uploading video: {e}")
-            return None
+            return self._upload_failed("video", e)
     
     def upload_audio(self, file_path, folder="vidsnap/audio"):
         """Upload audio to Cloudinary"""
         if not self.enabled:
             return None
         try:
-            result = cloudinary.uploader.upload(
+            return self._upload(
                 file_path,
-                folder=folder,
-                resource_type="video",  # Cloudinary treats audio as video
+                folder,
+                "video",  # Cloudinary treats audio as video
                 format="mp3"
             )
-            return result['secure_url']
         except Exception as e:
-            print(f"Error uploading audio: {e}")
+            return self._upload_failed("audio", e)
+    
+    def upload_preview(self, file_path, folder="vidsnap/previews"):
+        """Upload a gallery preview clip to Cloudinary as is (it is already small)"""
+        if not self.enabled:
+            return None
+        try:
+            return self._upload(file_path, folder, "video")
+        except Exception as e:
+            return self._upload_failed("preview", e)
+    
+    def upload_poster(self, file_path, folder="vidsnap/posters"):
+        """Upload a reel's poster frame to Cloudinary as is (already sized for the gallery)"""
+        if not self.enabled:
             return None
+        try:
+            return self._upload(file_path, folder, "image")
+        except Exception as e:
+            return self._upload_failed("poster", e)
+    
+    def upload_async(self, kind, file_path):
+        """Start an upload ('image', 'video', 'audio', 'preview' or 'poster') and return a Future of its URL"""
+        upload = {"image": self.upload_image, "video": self.upload_video, "audio": self.upload_audio,
+                  "preview": self.upload_preview, "poster": self.upload_poster}[kind]
+        if not self.enabled:
+            return self._pool.submit(upload, file_path)
+        
+        def timed_upload():
+            with UPLOAD_SECONDS.labels(kind).time():
+                return upload(file_path)
+        return self._pool.submit(timed_upload)
     
     def delete_file(self, public_id):
         """Delete file from Cloudinary"""
         if not self.enabled:
             return False
         try:
-            result = cloudinary.uploader.destroy(public_id)
+            result = rate_limited(cloudinary.uploader.destroy)(public_id)
             return result.get('result') == 'ok'
         except Exception as e:
             print(f"Error deleting file: {e}")
@@ -7,3 +7,79 @@ ELEVENLABS_API_KEY = os.getenv('ELEVENLABS_API_KEY', "sk_6e430f1c91f476973913376
 CLOUDINARY_CLOUD_NAME = os.getenv('CLOUDINARY_CLOUD_NAME')
 CLOUDINARY_API_KEY = os.getenv('CLOUDINARY_API_KEY')
 CLOUDINARY_API_SECRET = os.getenv('CLOUDINARY_API_SECRET')
+
+# Threads per background worker pipeline stage. ffmpeg already runs in its
+# own process, so render threads only wait on the encoder.
+RENDER_CONCURRENCY = int(os.getenv('VIDSNAP_RENDER_CONCURRENCY', os.cpu_count() or 1))
+TTS_CONCURRENCY = int(os.getenv('VIDSNAP_TTS_CONCURRENCY', '4'))
+UPLOAD_CONCURRENCY = int(os.getenv('VIDSNAP_UPLOAD_CONCURRENCY', '4'))
+# Reels a worker claims beyond its render threads. Claimed reels are worked
+# through in claim order, so a new submitter's reel waits behind at most
+# this many others before its render starts
+CLAIM_AHEAD = int(os.getenv('VIDSNAP_CLAIM_AHEAD', '1'))
+# Encoder threads per ffmpeg run, split so concurrent renders don't oversubscribe the CPUs
+FFMPEG_THREADS = int(os.getenv('VIDSNAP_FFMPEG_THREADS', max(1, (os.cpu_count() or 1) // RENDER_CONCURRENCY)))
+
+# Disk cache of synthesized speech, evicted least-recently-used past the size cap
+TTS_CACHE_DIR = os.getenv('VIDSNAP_TTS_CACHE_DIR', os.path.join('.cache', 'tts'))
+TTS_CACHE_MAX_BYTES = int(os.getenv('VIDSNAP_TTS_CACHE_MAX_MB', '512')) * 1024 * 1024
+
+# Finished renders, keyed by a fingerprint of their inputs (0 MB disables)
+RENDER_CACHE_DIR = os.getenv('VIDSNAP_RENDER_CACHE_DIR', os.path.join('.cache', 'render'))
+RENDER_CACHE_MAX_BYTES = int(os.getenv('VIDSNAP_RENDER_CACHE_MAX_MB', '2048')) * 1024 * 1024
+
+# Speech synthesis: backend ("elevenlabs", "local" or "stub"; see tts_backends.py),
+# an optional fallback used when it fails or times out, and sentence-chunking
+# of long descriptions into concurrently synthesized parts
+TTS_BACKEND = os.getenv('VIDSNAP_TTS_BACKEND', 'elevenlabs')
+TTS_FALLBACK_BACKEND = os.getenv('VIDSNAP_TTS_FALLBACK', '')
+TTS_TIMEOUT_SECONDS = float(os.getenv('VIDSNAP_TTS_TIMEOUT_SECONDS', '60'))
+TTS_CHUNK_CHARS = int(os.getenv('VIDSNAP_TTS_CHUNK_CHARS', '400'))
+TTS_CHUNK_CONCURRENCY = int(os.getenv('VIDSNAP_TTS_CHUNK_CONCURRENCY', '4'))
+LOCAL_TTS_VOICE = os.getenv('VIDSNAP_LOCAL_TTS_VOICE', 'en-us')
+PIPER_MODEL = os.getenv('VIDSNAP_PIPER_MODEL', '')
+STUB_TTS_LATENCY = float(os.getenv('VIDSNAP_STUB_TTS_LATENCY', '0'))
+STUB_TTS_TONE_HZ = int(os.getenv('VIDSNAP_STUB_TTS_TONE_HZ', '0'))
+
+# Crossfade between slideshow images in seconds (0 = hard cuts)
+CROSSFADE_SECONDS = float(os.getenv('VIDSNAP_CROSSFADE_SECONDS', '0.5'))
+# Default encoder profile (see renderer.RENDER_PROFILES); reels can override it
+RENDER_PROFILE = os.getenv('VIDSNAP_RENDER_PROFILE', 'standard')
+
+# Upload limits: each image, and the whole multipart request
+MAX_UPLOAD_FILE_BYTES = int(os.getenv('VIDSNAP_MAX_UPLOAD_FILE_MB', '25')) * 1024 * 1024
+MAX_UPLOAD_REQUEST_BYTES = int(os.getenv('VIDSNAP_MAX_UPLOAD_REQUEST_MB', '200')) * 1024 * 1024
+
+# Cloudinary videos larger than this are sent with the chunked upload API
+CLOUDINARY_CHUNK_THRESHOLD_BYTES = int(os.getenv('VIDSNAP_CHUNKED_UPLOAD_MB', '20')) * 1024 * 1024
+CLOUDINARY_CHUNK_SIZE_BYTES = int(os.getenv('VIDSNAP_UPLOAD_CHUNK_MB', '6')) * 1024 * 1024
+
+# Client-side limits on provider calls, shared by the workers on one host:
+# requests per second and concurrent calls (0 = unlimited)
+RATE_LIMIT_DIR = os.getenv('VIDSNAP_RATE_LIMIT_DIR', os.path.join('.cache', 'ratelimit'))
+ELEVENLABS_RATE = float(os.getenv('VIDSNAP_ELEVENLABS_RPS', '5'))
+ELEVENLABS_MAX_IN_FLIGHT = int(os.getenv('VIDSNAP_ELEVENLABS_MAX_IN_FLIGHT', '4'))
+CLOUDINARY_RATE = float(os.getenv('VIDSNAP_CLOUDINARY_RPS', '10'))
+CLOUDINARY_MAX_IN_FLIGHT = int(os.getenv('VIDSNAP_CLOUDINARY_MAX_IN_FLIGHT', '8'))
+
+# Reels that fail with a transient error (rate limit, provider 5xx, timeout)
+# are retried with exponential backoff before being moved to 'dead'
+RETRY_MAX_ATTEMPTS = int(os.getenv('VIDSNAP_RETRY_MAX_ATTEMPTS', '5'))
+RETRY_BASE_SECONDS = float(os.getenv('VIDSNAP_RETRY_BASE_SECONDS', '30'))
+RETRY_MAX_DELAY_SECONDS = float(os.getenv('VIDSNAP_RETRY_MAX_DELAY_SECONDS', '1800'))
+
+# Reverse proxies in front of the app (e.g. 1 on Railway or Render) whose
+# X-Forwarded-For entries are trusted for the client address; 0 trusts none
+PROXY_HOPS = int(os.getenv('VIDSNAP_PROXY_HOPS', '0'))
+
+# Reels per gallery page
+GALLERY_PAGE_SIZE = int(os.getenv('VIDSNAP_GALLERY_PAGE_SIZE', '24'))
+
+# Longest a status long-poll (?wait=) is held open, in seconds
+LONG_POLL_SECONDS = float(os.getenv('VIDSNAP_LONG_POLL_SECONDS', '25'))
+
+# Processor log: rotated (gzipped) once it reaches VIDSNAP_LOG_MAX_MB
+LOG_PATH = os.getenv('VIDSNAP_LOG_PATH', os.path.join('static', 'processor.log'))
+LOG_MAX_BYTES = int(float(os.getenv('VIDSNAP_LOG_MAX_MB', '10')) * 1024 * 1024)
+LOG_BACKUPS = int(os.getenv('VIDSNAP_LOG_BACKUPS', '5'))
+LOG_LEVEL = os.getenv('VIDSNAP_LOG_LEVEL', 'INFO').upper()
@@ -0,0 +1,163 @@
+"""Size-bounded, content-addressed file cache on local disk.
+
+Entries are files named by a hash key. A hit refreshes the entry's mtime,
+and when the cache grows past `max_bytes` the least recently used entries
+are deleted. Writes go through a temp file and os.replace, so several
+worker processes can share one cache directory safely.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+
+def cache_key(*parts):
+    """Stable hash of JSON-serializable parts"""
+    payload = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """sha256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(src, dest):
+    """Hard-link src to dest (instant, no extra space), copying across filesystems"""
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+
+
+class DiskLRUCache:
+    def __init__(self, directory, max_bytes, suffix=''):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key, dest_path, count=True):
+        """Materialize the entry at dest_path; returns False on a miss.
+
+        With count=False the lookup is left out of the hit statistics
+        (callers that look up several entries per logical lookup use
+        record_lookup() instead).
+        """
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+            link_or_copy(path, dest_path)
+        except FileNotFoundError:
+            if count:
+                self.record_lookup(False)
+            return False
+        if count:
+            self.record_lookup(True)
+        return True
+
+    def put(self, key, src_path, link=False):
+        """Store src_path under key: a copy, or with link=True a hard link
+        (only for files that are never modified in place afterwards)"""
+        if link:
+            self._store(key, lambda tmp_path: link_or_copy(src_path, tmp_path))
+        else:
+            self._store(key, lambda tmp_path: shutil.copyfile(src_path, tmp_path))
+
+    def read(self, key, count=True):
+        """Return the entry's bytes, or None on a miss"""
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            if count:
+                self.record_lookup(False)
+            return None
+        if count:
+            self.record_lookup(True)
+        return data
+
+    def record_lookup(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def write(self, key, data):
+        """Store bytes under key"""
+        def writer(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+        self._store(key, writer)
+
+    def _store(self, key, writer):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        os.close(fd)
+        try:
+            writer(tmp_path)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, self.path_for(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.startswith('.tmp-'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        # Other processes may share the directory, so re-measure before deleting
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+        self._size = total
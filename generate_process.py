@@ -1,7 +1,8 @@
 import os
 from text_to_audio import text_to_speech_file
 import time
-import subprocess
+from renderer import RenderError, find_images, render_slideshow
+from job_queue import Backoff
 
 def text_to_audio(folder):
     print("TTA -", folder)
@@ -18,30 +19,22 @@ def create_reel(folder):
     output_path = f"static/reels/{folder}.mp4"
     os.makedirs("static/reels", exist_ok=True)
     
-    input_txt_path = f"user_uploads/{folder}/input.txt"
     audio_path = f"user_uploads/{folder}/audio.mp3"
     
-    if not os.path.exists(input_txt_path):
-        print(f"Input file not found: {input_txt_path}")
-        return False
-        
     if not os.path.exists(audio_path):
         print(f"Audio file not found: {audio_path}")
         return False
     
-    command = f'''ffmpeg -f concat -safe 0 -i {input_txt_path} -i {audio_path} \
--vf "scale=1080:1920:force_original_aspect_ratio=decrease,pad=1080:1920:(ow-iw)/2:(oh-ih)/2:black" \
--c:v libx264 -c:a aac -shortest -r 30 -pix_fmt yuv420p {output_path}'''.strip()
-    
     try:
-        subprocess.run(command, shell=True, check=True)
+        render_slideshow(find_images(f"user_uploads/{folder}"), audio_path, output_path)
         print("CR -", folder)
         return True
-    except subprocess.CalledProcessError as e:
+    except RenderError as e:
         print(f"FFmpeg error for {folder}: {e}")
         return False
 
 if __name__ == "__main__":
+    idle = Backoff()
     while True:
         print("Processing Queue.....")
         if os.path.exists("done.txt"):
@@ -60,10 +53,12 @@ if __name__ == "__main__":
                         with open("done.txt", "a") as f:
                             f.write(folder + "\n")
                         print(f"Successfully processed: {folder}")
+                        idle.reset()
                     else:
                         print(f"Failed to create reel for: {folder}")
                 except Exception as e:
                     print(f"Error processing {folder}: {e}")
                     continue
 
-        time.sleep(4)
+        # Runs as its own process with no one to notify it, so back off while idle
+        time.sleep(idle.next())
@@ -0,0 +1,60 @@
+"""One-time normalization of uploaded images.
+
+Phone photos arrive as multi-megapixel JPEGs, often rotated only through
+their EXIF orientation tag. Each upload is decoded once, turned upright,
+fitted onto the 1080x1920 reel canvas and stored as a small JPEG in a
+`normalized/` folder next to the original. Renders then read frames that
+already match the canvas, so ffmpeg's scale/pad filters have nothing to do
+and every re-render skips the large decode.
+
+Pillow is optional: without it the originals are used and ffmpeg does the
+fitting as before.
+"""
+import os
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - Pillow is in requirements.txt
+    Image = None
+
+from renderer import WIDTH, HEIGHT, find_images
+
+NORMALIZED_DIR = "normalized"
+JPEG_QUALITY = 90
+
+
+def normalized_path(upload_dir, image_path):
+    # Keep the original extension in the name so 1.png and 1.jpg don't collide
+    return os.path.join(upload_dir, NORMALIZED_DIR, os.path.basename(image_path) + ".jpg")
+
+
+def normalize_image(src, dest, width=WIDTH, height=HEIGHT):
+    """Write an upright, canvas-sized JPEG version of src to dest"""
+    with Image.open(src) as image:
+        # Let the JPEG decoder downscale by a power of two while decoding
+        image.draft("RGB", (width, height))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        canvas = ImageOps.pad(image, (width, height), method=Image.LANCZOS, color=(0, 0, 0))
+    tmp = dest + ".tmp"
+    canvas.save(tmp, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    os.replace(tmp, dest)
+
+
+def normalize_uploads(upload_dir):
+    """Normalize every image in upload_dir (skipping ones already done).
+
+    Returns the images to render, in upload order: the normalized copies,
+    or the originals when Pillow is unavailable.
+    """
+    originals = find_images(upload_dir)
+    if Image is None:
+        return originals
+
+    os.makedirs(os.path.join(upload_dir, NORMALIZED_DIR), exist_ok=True)
+    frames = []
+    for original in originals:
+        dest = normalized_path(upload_dir, original)
+        if not os.path.exists(dest) or os.path.getmtime(dest) < os.path.getmtime(original):
+            normalize_image(original, dest)
+        frames.append(dest)
+    return frames
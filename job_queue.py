@@ -0,0 +1,355 @@
+"""Job claiming for the reel render queue.
+
+A reel waiting to be rendered has status 'processing'. A worker claims it by
+stamping `claimed_by` with its worker id and setting `lease_expires_at`; the
+claim is a single UPDATE whose target row is picked by a sub-select, so two
+workers can never claim the same reel. On Postgres the sub-select uses
+`FOR UPDATE SKIP LOCKED` so concurrent claimers skip each other's rows
+instead of queueing behind them; SQLite serializes writers, which makes the
+same statement atomic there. Reels are claimed by priority, then with
+submitters taking turns (see claim_order). A worker that dies keeps its lease only until
+it expires, after which the reel becomes claimable again. Every claim counts
+an attempt; a reel waiting to be retried (see retry.py) stays out of reach
+until its `next_attempt_at`.
+
+Idle workers don't poll on a fixed timer. notify_new_reel() wakes workers
+in the same process directly and, on Postgres, workers elsewhere through
+LISTEN/NOTIFY; polling with adaptive backoff remains as the fallback (and
+is what notices expired leases).
+
+Finished reels are announced the same way (notify_status_change, on the
+STATUS_CHANNEL), so status long-polls in the web app return as soon as a
+worker commits.
+"""
+import logging
+import os
+import select as selectors
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, case, func, or_, select, text, update
+
+from models import db, Reel
+
+LEASE_SECONDS = int(os.getenv('VIDSNAP_LEASE_SECONDS', '900'))
+POLL_MIN_SECONDS = float(os.getenv('VIDSNAP_POLL_MIN_SECONDS', '0.5'))
+POLL_MAX_SECONDS = float(os.getenv('VIDSNAP_POLL_MAX_SECONDS', '10'))
+# Claim order (see claim_order): reels finished this recently still count
+# towards their submitter's turns, and every this-long wait lifts a negative
+# priority by one, down to MIN_PRIORITY
+QUEUE_FAIRNESS_WINDOW_SECONDS = float(os.getenv('VIDSNAP_QUEUE_FAIRNESS_WINDOW_SECONDS', '900'))
+QUEUE_AGING_SECONDS = float(os.getenv('VIDSNAP_QUEUE_AGING_SECONDS', '900'))
+MIN_PRIORITY = -10
+# Among equals, claim reels with shorter descriptions (quicker to render) first
+QUEUE_SHORT_FIRST = os.getenv('VIDSNAP_QUEUE_SHORT_FIRST', '').lower() in ('1', 'true', 'yes')
+NOTIFY_CHANNEL = 'vidsnap_reels'
+STATUS_CHANNEL = 'vidsnap_reel_status'
+
+logger = logging.getLogger(__name__)
+
+_new_reel = threading.Event()
+# Bumped whenever a reel's status changes; long-polls wait on it
+_status_changed = threading.Condition()
+_status_version = 0
+
+
+def make_worker_id(suffix=None):
+    """Return an id unique to this host, process and (optionally) worker slot"""
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+    if suffix is not None:
+        worker_id = f"{worker_id}:{suffix}"
+    return worker_id
+
+
+def claimable_filter(now=None):
+    """Reels that are waiting, due, and not held by a live lease"""
+    now = now or datetime.utcnow()
+    return and_(
+        Reel.status == 'processing',
+        or_(Reel.claimed_by.is_(None), Reel.lease_expires_at < now),
+        or_(Reel.next_attempt_at.is_(None), Reel.next_attempt_at <= now),
+    )
+
+
+def claim_order(now=None, window_seconds=QUEUE_FAIRNESS_WINDOW_SECONDS,
+                aging_seconds=QUEUE_AGING_SECONDS, short_first=QUEUE_SHORT_FIRST):
+    """Select claimable reel ids, next to claim first.
+
+    Submitters take turns. A submitter's reels are numbered in the order
+    they were queued, counting the ones still waiting or in progress and
+    the ones finished in the last `window_seconds`; every submitter's
+    first turn comes before anyone's second. A bulk submission therefore
+    waits behind other people's reels, however old it is, while its own
+    reels keep getting a turn each round.
+
+    Higher `priority` goes before the turns. A negative priority rises by
+    one for every `aging_seconds` the reel has waited, up to 0, so batch
+    work still drains under steady interactive load.
+    """
+    now = now or datetime.utcnow()
+    turns = (
+        select(
+            Reel.id,
+            func.row_number().over(
+                # Reels from before submitters were recorded count as their own
+                partition_by=func.coalesce(Reel.submitter, Reel.reel_id),
+                order_by=(Reel.created_at, Reel.id),
+            ).label('turn'),
+        )
+        .where(or_(Reel.status == 'processing', Reel.updated_at >= now - timedelta(seconds=window_seconds)))
+        .subquery()
+    )
+    # One step per aging period waited, as a sum of CASEs (portable SQL)
+    aged_steps = sum(
+        case((Reel.created_at < now - timedelta(seconds=aging_seconds * step), 1), else_=0)
+        for step in range(1, -MIN_PRIORITY + 1)
+    )
+    priority = case(
+        (Reel.priority >= 0, Reel.priority),
+        (Reel.priority + aged_steps >= 0, 0),
+        else_=Reel.priority + aged_steps,
+    )
+    order = [priority.desc(), turns.c.turn]
+    if short_first:
+        order.append(func.length(Reel.description))
+    return (
+        select(Reel.id)
+        .join(turns, turns.c.id == Reel.id)
+        .where(claimable_filter(now))
+        .order_by(*order, Reel.created_at, Reel.id)
+    )
+
+
+def claim_next_reel(worker_id, lease_seconds=LEASE_SECONDS):
+    """Atomically claim the next reel in claim_order() and count the attempt.
+
+    Returns the claimed Reel (attached to the current session) or None when
+    the queue is empty.
+    """
+    now = datetime.utcnow()
+    candidate = (
+        claim_order(now)
+        .limit(1)
+        # Lock only the reel row; the turn numbers come from a window
+        # function, which can't be locked
+        .with_for_update(skip_locked=True, of=Reel)
+        .scalar_subquery()
+    )
+    stmt = (
+        update(Reel)
+        .where(Reel.id == candidate)
+        .values(claimed_by=worker_id, lease_expires_at=now + timedelta(seconds=lease_seconds),
+                attempts=func.coalesce(Reel.attempts, 0) + 1)
+        .returning(Reel.id)
+        .execution_options(synchronize_session=False)
+    )
+    try:
+        claimed_id = db.session.execute(stmt).scalar()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if claimed_id is None:
+        return None
+    return db.session.get(Reel, claimed_id, populate_existing=True)
+
+
+def renew_leases(reel_ids, worker_id, lease_seconds=LEASE_SECONDS):
+    """Push the leases forward; returns how many this worker still holds"""
+    stmt = (
+        update(Reel)
+        .where(Reel.id.in_(reel_ids), Reel.claimed_by == worker_id)
+        .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=lease_seconds))
+        .execution_options(synchronize_session=False)
+    )
+    renewed = db.session.execute(stmt).rowcount
+    db.session.commit()
+    return renewed
+
+
+def finish_reel(reel_id, worker_id, events=(), **values):
+    """Write the job's outcome and drop the claim in one conditional UPDATE.
+
+    `events` (unsaved rows, e.g. ReelStageEvent) are inserted in the same
+    transaction. Returns False (and writes nothing) if this worker no
+    longer holds the lease, e.g. because it expired and another worker
+    took the reel over.
+    """
+    stmt = (
+        update(Reel)
+        .where(Reel.id == reel_id, Reel.claimed_by == worker_id)
+        .values(claimed_by=None, lease_expires_at=None, updated_at=datetime.utcnow(), **values)
+        .execution_options(synchronize_session=False)
+    )
+    try:
+        finished = db.session.execute(stmt).rowcount == 1
+        if finished and events:
+            db.session.add_all(events)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if finished:
+        notify_status_change(reel_id)
+    return finished
+
+
+class LeaseKeeper:
+    """Renews the leases of every reel a worker has in flight"""
+
+    def __init__(self, app, worker_id, lease_seconds=LEASE_SECONDS):
+        self.app = app
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self._reel_ids = set()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def add(self, reel_id):
+        with self._lock:
+            self._reel_ids.add(reel_id)
+
+    def discard(self, reel_id):
+        with self._lock:
+            self._reel_ids.discard(reel_id)
+
+    def _run(self):
+        interval = max(self.lease_seconds / 3, 1)
+        with self.app.app_context():
+            while True:
+                time.sleep(interval)
+                with self._lock:
+                    reel_ids = list(self._reel_ids)
+                if not reel_ids:
+                    continue
+                try:
+                    renewed = renew_leases(reel_ids, self.worker_id, self.lease_seconds)
+                    if renewed < len(reel_ids):
+                        logger.warning("⚠️  Lost %d lease(s) held by %s", len(reel_ids) - renewed, self.worker_id)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.warning("⚠️  Lease renewal failed for %s: %s", self.worker_id, e)
+
+
+def notify_new_reel(reel_id=''):
+    """Wake idle workers after a new reel has been committed"""
+    _new_reel.set()
+    if db.engine.dialect.name == 'postgresql':
+        try:
+            db.session.execute(text("SELECT pg_notify(:channel, :payload)"),
+                               {'channel': NOTIFY_CHANNEL, 'payload': reel_id})
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.warning("⚠️  Could not notify workers: %s", e)
+
+
+def notify_status_change(reel_id=''):
+    """Wake status long-polls after a reel's status change has been committed"""
+    _bump_status_version()
+    if db.engine.dialect.name == 'postgresql':
+        try:
+            db.session.execute(text("SELECT pg_notify(:channel, :payload)"),
+                               {'channel': STATUS_CHANNEL, 'payload': str(reel_id)})
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.warning("⚠️  Could not announce status change: %s", e)
+
+
+def _bump_status_version():
+    global _status_version
+    with _status_changed:
+        _status_version += 1
+        _status_changed.notify_all()
+
+
+def status_version():
+    return _status_version
+
+
+def wait_for_status_change(version, timeout):
+    """Block until the status version moves past `version` or `timeout` passes.
+
+    Returns the current version.
+    """
+    with _status_changed:
+        _status_changed.wait_for(lambda: _status_version != version, timeout)
+        return _status_version
+
+
+def wait_for_new_reel(timeout):
+    """Block until notify_new_reel() fires or `timeout` seconds pass"""
+    woken = _new_reel.wait(timeout)
+    _new_reel.clear()
+    return woken
+
+
+class Backoff:
+    """Poll interval that doubles while idle and resets once work shows up"""
+
+    def __init__(self, minimum=POLL_MIN_SECONDS, maximum=POLL_MAX_SECONDS):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.current = minimum
+
+    def reset(self):
+        self.current = self.minimum
+
+    def next(self):
+        interval = self.current
+        self.current = min(self.current * 2, self.maximum)
+        return interval
+
+
+def start_notification_listener(app):
+    """On Postgres, forward NOTIFYs from other processes to this one's
+    workers and status long-polls.
+
+    Returns the listener thread, or None on databases without LISTEN.
+    """
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != 'postgresql' or engine.dialect.driver != 'psycopg2':
+        return None
+    thread = threading.Thread(target=_listen, args=(engine,), daemon=True)
+    thread.start()
+    return thread
+
+
+def _listen(engine):
+    while True:
+        conn = None
+        try:
+            conn = engine.raw_connection()
+            conn.detach()
+            pg = conn.driver_connection
+            pg.autocommit = True
+            with pg.cursor() as cursor:
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                cursor.execute(f"LISTEN {STATUS_CHANNEL}")
+            logger.info("👂 Listening for new reels on '%s' and status changes on '%s'", NOTIFY_CHANNEL, STATUS_CHANNEL)
+            while True:
+                if selectors.select([pg], [], [], 60) == ([], [], []):
+                    continue
+                pg.poll()
+                channels = {notify.channel for notify in pg.notifies}
+                pg.notifies.clear()
+                if NOTIFY_CHANNEL in channels:
+                    _new_reel.set()
+                if STATUS_CHANNEL in channels:
+                    _bump_status_version()
+        except Exception as e:
+            logger.warning("⚠️  Notification listener error: %s; reconnecting", e)
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            time.sleep(5)
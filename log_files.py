@@ -0,0 +1,225 @@
+"""Logging for the web app and worker, and reads of the processor log file.
+
+setup_logging() sends every record through a queue to a background thread
+that writes it to the console and, as one JSON object per line, to the log
+file. Records logged inside log_context(reel_id=..., stage=...) carry those
+fields, so one reel's trail through the pipeline can be filtered out.
+
+The log file is appended to by the web app and its worker thread. Once it grows
+past VIDSNAP_LOG_MAX_MB it is gzipped to processor.log.1.gz (older
+archives shift up to .N.gz, the oldest is dropped) and a fresh file is
+started. Readers never load the whole file: read_log() seeks to a byte
+offset, or to the last few KB on first view, so following the log costs
+only the bytes written since the previous read.
+"""
+import atexit
+import contextvars
+import copy
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from config import LOG_PATH, LOG_MAX_BYTES, LOG_BACKUPS, LOG_LEVEL
+
+TAIL_BYTES = 64 * 1024
+READ_LIMIT = 256 * 1024
+
+
+def archive_path(path, number):
+    return f"{path}.{number}.gz"
+
+
+def archive(src, path, backups=LOG_BACKUPS):
+    """Gzip `src` into the first archive slot of `path`, shifting older archives up"""
+    if backups < 1:
+        os.remove(src)
+        return
+    for number in range(backups - 1, 0, -1):
+        if os.path.exists(archive_path(path, number)):
+            os.replace(archive_path(path, number), archive_path(path, number + 1))
+    with open(src, 'rb') as f, gzip.open(archive_path(path, 1) + '.tmp', 'wb') as dest:
+        shutil.copyfileobj(f, dest)
+    os.replace(archive_path(path, 1) + '.tmp', archive_path(path, 1))
+    os.remove(src)
+
+
+class GzipRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler whose backups are gzip archives (processor.log.N.gz)"""
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        staged = self.baseFilename + '.rotating'
+        os.replace(self.baseFilename, staged)
+        # Open the new file while the old one still exists, so it gets a new
+        # inode and readers following by file id notice the rotation
+        self.stream = self._open()
+        archive(staged, self.baseFilename, self.backupCount)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, reel_id, stage"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+            'reel_id': getattr(record, 'reel_id', None),
+            'stage': getattr(record, 'stage', None),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Unlike the stdlib version, keep the traceback out of the message so
+        # the JSON formatter can store it in its own field
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_log_context = contextvars.ContextVar('log_context', default={})
+
+
+@contextmanager
+def log_context(**fields):
+    """Attach fields (reel_id, stage) to every record logged inside the block"""
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        for key, value in _log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class StreamToLogger:
+    """File-like object turning print() output into log records, line by line"""
+
+    def __init__(self, logger, level):
+        self.logger = logger
+        self.level = level
+        self._partial = threading.local()
+
+    def write(self, message):
+        buffered = getattr(self._partial, 'text', '') + message
+        *lines, self._partial.text = buffered.split('\n')
+        for line in lines:
+            if line.strip():
+                self.logger.log(self.level, line.rstrip())
+        return len(message)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+_listener = None
+
+
+def setup_logging(path=LOG_PATH, level=LOG_LEVEL, capture_prints=True):
+    """Route logging through a queue to the console and the JSON log file.
+
+    Callers only put records on an in-memory queue; a QueueListener thread
+    formats them and does the disk writes, so logging never blocks a worker
+    on I/O. With capture_prints, print() output and tracebacks on
+    stdout/stderr are logged too (as INFO and ERROR). Safe to call twice.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    console = logging.StreamHandler(sys.__stdout__)
+    console.setFormatter(logging.Formatter('%(message)s'))
+    logfile = GzipRotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding='utf-8')
+    logfile.setFormatter(JsonFormatter())
+
+    records = queue.SimpleQueue()
+    handler = LogQueueHandler(records)
+    # Context is read on the logging thread, before the record is queued
+    handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(handler)
+    _listener = logging.handlers.QueueListener(records, console, logfile, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    if capture_prints:
+        sys.stdout = StreamToLogger(logging.getLogger('stdout'), logging.INFO)
+        sys.stderr = StreamToLogger(logging.getLogger('stderr'), logging.ERROR)
+
+
+def read_log(path=LOG_PATH, offset=None, file_id=None, limit=READ_LIMIT):
+    """Read the log from byte `offset` (default: its last TAIL_BYTES).
+
+    `file_id` is the id returned by the previous read; if the file has
+    been rotated since, reading restarts at the start of the new file.
+    Returns {'text', 'offset' (where to continue), 'file_id', 'more'}.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return {'text': '', 'offset': 0, 'file_id': None, 'more': False}
+    current_id = f"{stat.st_dev}-{stat.st_ino}"
+    tail = offset is None
+    if tail:
+        offset = max(stat.st_size - TAIL_BYTES, 0)
+    elif file_id != current_id or offset > stat.st_size:
+        offset = 0
+
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(limit)
+    if tail and offset:
+        # A tail starts mid-line; drop the partial first line
+        newline = data.find(b'\n')
+        if newline != -1:
+            data = data[newline + 1:]
+            offset += newline + 1
+    data = _whole_characters(data)
+    return {
+        'text': data.decode('utf-8', errors='replace'),
+        'offset': offset + len(data),
+        'file_id': current_id,
+        'more': offset + len(data) < stat.st_size,
+    }
+
+
+def _whole_characters(data):
+    """Trim a UTF-8 character cut off at the end of `data` (it is re-read next time)"""
+    for back in range(1, min(4, len(data)) + 1):
+        byte = data[-back]
+        if byte & 0xC0 != 0x80:  # ASCII or the lead byte of a sequence
+            length = 1 if byte < 0x80 else 4 if byte >= 0xF0 else 3 if byte >= 0xE0 else 2
+            return data if length <= back else data[:-back]
+    return data
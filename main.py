@@ -1,17 +1,33 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
 from flask_sqlalchemy import SQLAlchemy
 import uuid
 from werkzeug.utils import secure_filename
 import os
 import threading
-from models import db, Reel
+from models import db, Reel, ReelStageEvent, upgrade_schema, gallery_page, reel_statuses, latency_percentiles
 from cloud_storage import CloudStorage
 from background_processor import process_reels
+from job_queue import notify_new_reel, status_version, wait_for_status_change, MIN_PRIORITY
+from renderer import RENDER_PROFILES
+from uploads import UploadRequest, UploadRejected
+from config import MAX_UPLOAD_REQUEST_BYTES, GALLERY_PAGE_SIZE, LONG_POLL_SECONDS, PROXY_HOPS
+from log_files import setup_logging, read_log
+from metrics import REGISTRY, CONTENT_TYPE, REELS_WAITING
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.middleware.proxy_fix import ProxyFix
+from datetime import datetime, timedelta
+import hashlib
+import json
+import time
 
 UPLOAD_FOLDER = 'user_uploads'
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
 app = Flask(__name__)
+# Stream file parts to disk and validate them while they arrive
+app.request_class = UploadRequest
+if PROXY_HOPS:
+    # Trust only the X-Forwarded-For entries our own proxies appended
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS, x_proto=PROXY_HOPS)
 
 # Database configuration
 db_url = os.getenv('DATABASE_URL', 'sqlite:///vidsnap.db')
@@ -21,31 +37,14 @@ if db_url.startswith("postgres://"):
 app.config['SQLALCHEMY_DATABASE_URI'] = db_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-import sys
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_REQUEST_BYTES
 
 # Ensure static directory exists
 os.makedirs('static', exist_ok=True)
 
-# Define log path
-log_path = os.path.join('static', 'processor.log')
-
-# Redirect stdout and stderr to the log file to capture background thread output
-class Logger(object):
-    def __init__(self):
-        self.terminal = sys.stdout
-        self.log = open(log_path, "a")
-
-    def write(self, message):
-        self.terminal.write(message)
-        self.log.write(message)
-        self.log.flush()
-
-    def flush(self):
-        self.terminal.flush()
-        self.log.flush()
-
-sys.stdout = Logger()
-sys.stderr = sys.stdout
+# Log to the console and the JSON log file through a background thread;
+# print() output and tracebacks from any thread are captured as records
+setup_logging()
 
 app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-here')
 
@@ -70,43 +69,94 @@ with app.app_context():
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+@app.errorhandler(UploadRejected)
+@app.errorhandler(RequestEntityTooLarge)
+def upload_rejected(e):
+    """Uploads are validated while streaming, so these can fire mid-request"""
+    if isinstance(e, RequestEntityTooLarge):
+        error = f"Upload too large (limit {MAX_UPLOAD_REQUEST_BYTES // (1024 * 1024)} MB per reel)"
+    else:
+        error = e.description
+    return render_template("create.html", myid=str(uuid.uuid1()), error=error), e.code
 
 @app.route("/")
 def home():
     return render_template("index.html")
 
+def submitter_id():
+    """Who a reel is queued for, so the workers can take turns between
+    submitters: the browser session, or for clients that keep no cookies
+    the client address (so a script can't get a fresh turn per reel).
+    Behind a proxy, set VIDSNAP_PROXY_HOPS so this is the client's address
+    rather than the proxy's; X-Forwarded-For itself is never trusted."""
+    if 'submitter' in session:
+        return session['submitter']
+    return f"ip:{request.remote_addr}"
+
+
+def remove_partial_upload(upload_dir, paths, created_dir):
+    """Undo a failed /create: only the files it wrote, and the folder if it made it"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    if created_dir:
+        try:
+            os.rmdir(upload_dir)
+        except OSError:
+            pass
+
+
 @app.route("/create", methods=["GET", "POST"])
 def create():
     myid = str(uuid.uuid1())
+    submitter = submitter_id()
+    session.setdefault('submitter', uuid.uuid4().hex[:16])
 
     if request.method == "POST":
         rec_id = request.form.get("uuid")
         desc = request.form.get("text")
         title = request.form.get("title", "My Reel")
+        profile = request.form.get("profile") or None
+        # Batch clients may queue at a lower priority (negative); raising it is up to admins
+        try:
+            priority = max(min(int(request.form.get("priority") or 0), 0), MIN_PRIORITY)
+        except ValueError:
+            return render_template("create.html", myid=myid, error="Priority must be a whole number")
         
         if not rec_id or not desc:
             return render_template("create.html", myid=myid, error="Missing required fields")
+        # The id names the upload folder, so only a plain UUID will do
+        try:
+            rec_id = str(uuid.UUID(rec_id))
+        except ValueError:
+            return render_template("create.html", myid=myid, error="Invalid reel id")
+        if Reel.query.filter_by(reel_id=rec_id).first() is not None:
+            return render_template("create.html", myid=myid, error="This reel already exists")
+        if profile and profile not in RENDER_PROFILES:
+            return render_template("create.html", myid=myid, error="Unknown render profile")
             
         input_files = []
+        saved_paths = []
+        upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], rec_id)
+        created_dir = not os.path.isdir(upload_dir)
         try:
             # Create upload directory
-            upload_dir = os.path.join(app.config['UPLOAD_FOLDER'], rec_id)
             os.makedirs(upload_dir, exist_ok=True)
             
-            # Save uploaded files
+            # Move the streamed uploads into place (type and size were
+            # checked by UploadRequest while they arrived)
             for key, value in request.files.items():
                 file = request.files[key]
                 if file and file.filename != '':
-                    if allowed_file(file.filename):
-                        filename = secure_filename(file.filename)
-                        file.save(os.path.join(upload_dir, filename))
-                        input_files.append(filename)
-                    else:
-                        return render_template("create.html", myid=myid, error="Invalid file type")
+                    filename = secure_filename(file.filename)
+                    file.stream.save_as(os.path.join(upload_dir, filename))
+                    saved_paths.append(os.path.join(upload_dir, filename))
+                    input_files.append(filename)
             
             # Save description
+            saved_paths.append(os.path.join(upload_dir, "desc.txt"))
             with open(os.path.join(upload_dir, "desc.txt"), "w") as file:
                 file.write(desc)
             
@@ -115,12 +165,17 @@ def create():
                 reel_id=rec_id,
                 title=title,
                 description=desc,
-                status='processing'
+                status='processing',
+                render_profile=profile,
+                priority=priority,
+                submitter=submitter
             )
             db.session.add(new_reel)
             db.session.commit()
+            notify_new_reel(rec_id)
                     
         except Exception as e:
+            remove_partial_upload(upload_dir, saved_paths, created_dir)
             return render_template("create.html", myid=myid, error=f"Upload failed: {str(e)}")
         
         # If we reach here, upload was successful
@@ -131,49 +186,88 @@ def create():
 
 @app.route("/debug-reels")
 def debug_reels():
-    """Diagnostic route to check reel statuses"""
+    """Diagnostic route: latest reels plus stage latency percentiles.
+
+    ?limit= caps the reels listed (default 100); ?hours= limits the
+    percentiles to recent stage events.
+    """
     try:
-        reels = Reel.query.order_by(Reel.created_at.desc()).all()
+        limit = request.args.get('limit', 100, type=int)
+        hours = request.args.get('hours', type=float)
+        reels = Reel.query.order_by(Reel.created_at.desc()).limit(limit).all()
+        since = datetime.utcnow() - timedelta(hours=hours) if hours else None
         return {
-            "count": len(reels),
+            "count": db.session.query(db.func.count(Reel.id)).scalar(),
+            "latency_seconds": latency_percentiles(since=since),
             "reels": [reel.to_dict() for reel in reels]
         }
     except Exception as e:
         return {"error": str(e)}, 500
 
+@app.route("/debug-reels/<reel_id>")
+def debug_reel_timeline(reel_id):
+    """One reel with its stage timeline, across every processing attempt"""
+    reel = Reel.query.filter_by(reel_id=reel_id).first()
+    if reel is None:
+        return {"error": "Reel not found"}, 404
+    events = (ReelStageEvent.query.filter_by(reel_id=reel.id)
+              .order_by(ReelStageEvent.finished_at, ReelStageEvent.id).all())
+    return {**reel.to_dict(), "timeline": [event.to_dict() for event in events]}
+
 @app.route("/view-log")
 def view_log():
-    """View the background processor log"""
+    """View the background processor log; the page follows it through /api/log"""
+    html = """
+    <html>
+    <body style="background: #1a1a1a; color: #00ff00; font-family: monospace; padding: 20px;">
+        <h2>🚀 Live Processor Log (following)</h2>
+        <hr>
+        <pre id="log"></pre>
+        <script>
+        const log = document.getElementById('log');
+        let offset = null, fileId = null;
+        async function follow() {
+            let delay = 2000;
+            try {
+                const params = new URLSearchParams(offset === null ? {} : {offset, file_id: fileId});
+                const chunk = await (await fetch('/api/log?' + params)).json();
+                if (fileId !== null && chunk.file_id !== fileId) log.textContent += '\\n--- log rotated ---\\n';
+                offset = chunk.offset;
+                fileId = chunk.file_id;
+                if (chunk.text) {
+                    const atBottom = window.innerHeight + window.scrollY >= document.body.scrollHeight - 20;
+                    log.textContent += chunk.text;
+                    if (atBottom) window.scrollTo(0, document.body.scrollHeight);
+                }
+                if (chunk.more) delay = 0;
+            } catch (e) {
+                delay = 10000;
+            }
+            setTimeout(follow, delay);
+        }
+        follow();
+        </script>
+    </body>
+    </html>
+    """
+    return html
+
+@app.route("/api/log")
+def log_chunk():
+    """Log text from byte ?offset= (default: the tail) as JSON {text, offset, file_id, more}"""
     try:
-        log_path = "static/processor.log"
-        if not os.path.exists(log_path):
-            # Create it if missing to avoid 404
-            open(log_path, 'a').close()
-            return "Log file empty (just created)", 200
-            
-        with open(log_path, 'r') as f:
-            content = f.read()
-        
-        # Add a simple HTML wrapper with auto-refresh
-        html = f"""
-        <html>
-        <head><meta http-equiv="refresh" content="5"></head>
-        <body style="background: #1a1a1a; color: #00ff00; font-family: monospace; padding: 20px;">
-            <h2>🚀 Live Processor Log (Auto-refresh: 5s)</h2>
-            <hr>
-            <pre>{content}</pre>
-        </body>
-        </html>
-        """
-        return html
+        return jsonify(read_log(offset=request.args.get('offset', type=int),
+                                file_id=request.args.get('file_id')))
     except Exception as e:
-        return str(e), 500
+        return jsonify({"error": str(e)}), 500
 
 @app.route("/gallery")
 def gallery():
     try:
-        # Get reels from database, newest first
-        reels = Reel.query.order_by(Reel.created_at.desc()).all()
+        # One page of reels, newest first; ?before=<cursor> pages back in time
+        before = request.args.get('before')
+        status = request.args.get('status')
+        reels, next_cursor = gallery_page(before, GALLERY_PAGE_SIZE, status)
         reel_data = []
         
         for reel in reels:
@@ -183,14 +277,17 @@ def gallery():
                 'description': reel.description,
                 'video_url': reel.video_url,
                 'thumbnail_url': reel.thumbnail_url,
+                'preview_url': reel.preview_url,
+                'duration': reel.duration_seconds,
                 'status': reel.status,
                 'created_at': reel.created_at.strftime('%Y-%m-%d') if reel.created_at else 'Recently'
             })
         
-        return render_template("gallery.html", reels=reel_data)
+        return render_template("gallery.html", reels=reel_data, next_cursor=next_cursor,
+                               is_first_page=not before, status=status)
     except Exception as e:
         print(f"Error loading gallery: {e}")
-        return render_template("gallery.html", reels=[])
+        return render_template("gallery.html", reels=[], next_cursor=None, is_first_page=True, status=None)
 
 @app.route("/delete_reel/<reel_name>", methods=["POST"])
 def delete_reel(reel_name):
@@ -212,18 +309,79 @@ def delete_reel(reel_name):
         print(f"Error deleting reel {reel_name}: {e}")
         return {"success": False, "message": f"Error deleting reel: {str(e)}"}, 500
 
+# Status polls re-read the database at least this often while waiting, so
+# workers in other processes without LISTEN/NOTIFY (SQLite) are noticed too
+STATUS_RECHECK_SECONDS = 2
+MAX_STATUS_IDS = 100
+
+def status_response(reel_ids, single=False):
+    """Compact JSON statuses with an ETag; 304 if the client's copy is current.
+
+    With ?wait=<seconds>, a request whose If-None-Match still matches is held
+    open until a worker commits a status change (or the wait runs out).
+    """
+    wait = min(request.args.get('wait', 0, type=float), LONG_POLL_SECONDS)
+    deadline = time.monotonic() + wait
+    while True:
+        version = status_version()
+        statuses = reel_statuses(reel_ids)
+        if single and not statuses:
+            return jsonify({"error": "Reel not found"}), 404
+        body = json.dumps(statuses[reel_ids[0]] if single else statuses, separators=(',', ':'), sort_keys=True)
+        etag = hashlib.sha1(body.encode()).hexdigest()[:16]
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not request.if_none_match.contains(etag):
+            break
+        # End the read transaction so the next query sees new commits
+        db.session.rollback()
+        wait_for_status_change(version, min(remaining, STATUS_RECHECK_SECONDS))
+
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route("/api/reels/<reel_id>/status")
+def reel_status(reel_id):
+    return status_response([reel_id], single=True)
+
+@app.route("/api/reels/status")
+def reels_status():
+    """Batch form: ?ids=a,b,c returns {reel_id: status}"""
+    reel_ids = [reel_id for reel_id in request.args.get('ids', '').split(',') if reel_id][:MAX_STATUS_IDS]
+    if not reel_ids:
+        return jsonify({"error": "Pass reel ids as ?ids=a,b,c"}), 400
+    return status_response(reel_ids)
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus text exposition of the web app's and its worker's metrics"""
+    try:
+        # Queue depth is read from the database at scrape time
+        counts = dict(db.session.execute(
+            db.select(Reel.claimed_by.is_not(None), db.func.count())
+            .where(Reel.status == 'processing')
+            .group_by(Reel.claimed_by.is_not(None))
+        ).all())
+        REELS_WAITING.labels('yes').set(counts.get(True, 0))
+        REELS_WAITING.labels('no').set(counts.get(False, 0))
+    except Exception as e:
+        db.session.rollback()
+        print(f"⚠️  Could not count queued reels: {e}")
+    return app.response_class(REGISTRY.exposition(), mimetype=None, content_type=CONTENT_TYPE)
+
 @app.route("/init-db")
 def init_db():
     """Initialize database tables"""
     try:
         with app.app_context():
-            db.create_all()
+            upgrade_schema()
         return "Database initialized successfully!"
     except Exception as e:
         return f"Error initializing database: {e}"
 
 if __name__ == "__main__":
     with app.app_context():
-        db.create_all()
+        upgrade_schema()
     port = int(os.environ.get('PORT', 5001))
     app.run(debug=False, host='0.0.0.0', port=port)
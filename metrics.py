@@ -0,0 +1,224 @@
+"""In-process metrics in the Prometheus text exposition format.
+
+A deliberately small subset of prometheus_client: counters, gauges and
+histograms, optionally labelled, kept in one registry that main.py serves
+at /metrics. Any metric can also take its value from a callback at scrape
+time (set_function), which is how queue depth and cache hit counts are
+exported without being tracked on every change.
+
+Metrics live in the process that records them. The worker thread started
+by main.py shares the web app's registry; a worker started on its own
+(python background_processor.py) keeps its own, unexported copy.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; spans a cache hit to a long render
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _label_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Child:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._function = None
+
+    def set_function(self, function):
+        """Read the value from function() at scrape time instead"""
+        self._function = function
+
+
+class _Value(_Child):
+    def __init__(self):
+        super().__init__()
+        self._value = 0.0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def get(self):
+        return self._function() if self._function else self._value
+
+
+class _HistogramValue(_Child):
+    def __init__(self, buckets):
+        super().__init__()
+        self.buckets = buckets
+        self._counts = [0] * len(buckets)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value):
+        with self._lock:
+            self._sum += value
+            self._count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def snapshot(self):
+        with self._lock:
+            cumulative, running = [], 0
+            for count in self._counts:
+                running += count
+                cumulative.append(running)
+            return cumulative, self._sum, self._count
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self.labels()  # exported (as zero) before the first update
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}")
+        with self._lock:
+            if values not in self._children:
+                self._children[values] = self._new_child()
+            return self._children[values]
+
+    def __getattr__(self, attribute):
+        # Unlabelled metrics act as their only child: COUNTER.inc()
+        if attribute.startswith('_') or self.__dict__.get('labelnames', True):
+            raise AttributeError(attribute)
+        return getattr(self.labels(), attribute)
+
+    def samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in children:
+            try:
+                samples = list(self._child_samples(values, child))
+            except Exception:
+                continue  # a failing callback shouldn't break the scrape
+            yield from samples
+
+    def _child_samples(self, values, child):
+        yield self.name, _label_text(self.labelnames, values), child.get()
+
+    def _new_child(self):
+        return _Value()
+
+
+class Counter(_Metric):
+    type = "counter"
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def _child_samples(self, values, child):
+        cumulative, total, count = child.snapshot()
+        for bound, bucket_count in zip(self.buckets, cumulative):
+            le = (("le", _format_value(bound)),)
+            yield f"{self.name}_bucket", _label_text(self.labelnames, values, le), bucket_count
+        yield f"{self.name}_sum", _label_text(self.labelnames, values), total
+        yield f"{self.name}_count", _label_text(self.labelnames, values), count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def exposition(self):
+        """All metrics as Prometheus text (format version 0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                try:
+                    lines.append(f"{name}{labels} {_format_value(value)}")
+                except Exception:
+                    continue  # nor one that returns something other than a number
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Worker metrics
+STAGE_SECONDS = Histogram("vidsnap_stage_duration_seconds", "Time spent in each reel processing stage", ["stage"])
+STAGE_FAILURES = Counter("vidsnap_stage_failures_total", "Jobs that failed in each stage", ["stage"])
+STAGE_BUSY_SECONDS = Counter("vidsnap_stage_busy_seconds_total", "Worker-seconds spent handling jobs, per stage", ["stage"])
+STAGE_BUSY = Gauge("vidsnap_stage_busy_workers", "Stage workers currently handling a job", ["stage"])
+STAGE_WORKERS = Gauge("vidsnap_stage_workers", "Worker threads per stage", ["stage"])
+STAGE_QUEUE = Gauge("vidsnap_stage_queue_depth", "Jobs waiting in each stage's queue", ["stage"])
+UPLOAD_SECONDS = Histogram("vidsnap_upload_duration_seconds", "Time per Cloudinary upload", ["kind"])
+REELS_FINISHED = Counter("vidsnap_reels_finished_total", "Reels finished by this process, by outcome", ["status"])
+REEL_SECONDS = Histogram("vidsnap_reel_duration_seconds", "Time from claim to committed outcome")
+QUEUE_WAIT_SECONDS = Histogram("vidsnap_reel_queue_wait_seconds", "Time from upload to claim")
+REELS_WAITING = Gauge("vidsnap_reels_processing", "Reels with status 'processing', by whether a worker holds them", ["claimed"])
+RATE_LIMIT_WAIT_SECONDS = Histogram("vidsnap_rate_limit_wait_seconds", "Time provider calls waited for the client-side rate limiter", ["provider"])
+RATE_LIMITED = Counter("vidsnap_rate_limited_total", "Provider calls rejected with 429 (or Cloudinary's 420)", ["provider"])
+CACHE_HITS = Counter("vidsnap_cache_hits_total", "Cache lookups that hit", ["cache"])
+CACHE_MISSES = Counter("vidsnap_cache_misses_total", "Cache lookups that missed", ["cache"])
+CACHE_HIT_RATIO = Gauge("vidsnap_cache_hit_ratio", "Hits over lookups since start", ["cache"])
+
+
+def track_cache(name, cache):
+    """Export a DiskLRUCache's hit and miss counts under cache=name"""
+    CACHE_HITS.labels(name).set_function(lambda: cache.stats()['hits'])
+    CACHE_MISSES.labels(name).set_function(lambda: cache.stats()['misses'])
+    CACHE_HIT_RATIO.labels(name).set_function(lambda: cache.stats()['hit_ratio'])
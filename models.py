@@ -1,6 +1,10 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text, func, select, tuple_
+from sqlalchemy.exc import DatabaseError
 from datetime import datetime
+import math
 import os
+import time
 
 db = SQLAlchemy()
 
@@ -10,11 +14,30 @@ class Reel(db.Model):
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=False)
     video_url = db.Column(db.String(500), nullable=True)
-    thumbnail_url = db.Column(db.String(500), nullable=True)
+    thumbnail_url = db.Column(db.String(500), nullable=True)  # poster frame
+    preview_url = db.Column(db.String(500), nullable=True)  # short muted preview clip
+    duration_seconds = db.Column(db.Float, nullable=True)
     audio_url = db.Column(db.String(500), nullable=True)
-    status = db.Column(db.String(50), default='processing')  # processing, completed, failed
+    status = db.Column(db.String(50), default='processing')  # processing, completed, failed, dead
+    render_profile = db.Column(db.String(50), nullable=True)  # None = VIDSNAP_RENDER_PROFILE
+    priority = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # higher is claimed first
+    submitter = db.Column(db.String(64), nullable=True)  # who queued it, for fair-share claiming
+    claimed_by = db.Column(db.String(200), nullable=True)  # worker id holding the lease
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # claims so far
+    next_attempt_at = db.Column(db.DateTime, nullable=True)  # set while waiting to be retried
+    last_error = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # Claim queue and per-status listings, oldest or newest first
+        db.Index('ix_reel_status_created_at', 'status', 'created_at'),
+        # Keyset pagination of the gallery (newest first)
+        db.Index('ix_reel_created_at_id', 'created_at', 'id'),
+        # Recently finished reels, which still count towards fair-share turns
+        db.Index('ix_reel_updated_at', 'updated_at'),
+    )
     
     def to_dict(self):
         return {
@@ -24,8 +47,188 @@ class Reel(db.Model):
             'description': self.description,
             'video_url': self.video_url,
             'thumbnail_url': self.thumbnail_url,
+            'preview_url': self.preview_url,
+            'duration_seconds': self.duration_seconds,
             'audio_url': self.audio_url,
             'status': self.status,
+            'render_profile': self.render_profile,
+            'priority': self.priority,
+            'submitter': self.submitter,
+            'claimed_by': self.claimed_by,
+            'lease_expires_at': self.lease_expires_at.isoformat() if self.lease_expires_at else None,
+            'attempts': self.attempts,
+            'next_attempt_at': self.next_attempt_at.isoformat() if self.next_attempt_at else None,
+            'last_error': self.last_error,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
+
+
+class ReelStageEvent(db.Model):
+    """One stage of one processing attempt, written in a batch when the job ends.
+
+    Stages are the pipeline's (ingest, tts, render, upload) plus 'queue'
+    (upload to claim) and 'total' (upload to committed outcome).
+    """
+    __tablename__ = 'reel_stage_event'
+    id = db.Column(db.Integer, primary_key=True)
+    reel_id = db.Column(db.Integer, db.ForeignKey('reel.id', ondelete='CASCADE'), nullable=False, index=True)
+    stage = db.Column(db.String(30), nullable=False)
+    worker_id = db.Column(db.String(200), nullable=True)
+    started_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=False)
+    duration_seconds = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(20), nullable=False)  # ok, failed
+    error = db.Column(db.String(500), nullable=True)
+    exit_code = db.Column(db.Integer, nullable=True)  # ffmpeg's, for the render stage
+    output_bytes = db.Column(db.BigInteger, nullable=True)
+
+    __table_args__ = (
+        # Percentiles seek this index instead of sorting the table
+        db.Index('ix_reel_stage_event_stage_duration', 'stage', 'duration_seconds'),
+    )
+
+    def to_dict(self):
+        return {
+            'stage': self.stage,
+            'worker_id': self.worker_id,
+            'started_at': self.started_at.isoformat(),
+            'finished_at': self.finished_at.isoformat(),
+            'duration_seconds': self.duration_seconds,
+            'status': self.status,
+            'error': self.error,
+            'exit_code': self.exit_code,
+            'output_bytes': self.output_bytes,
+        }
+
+
+def latency_percentiles(percentiles=(50, 95, 99), since=None):
+    """{stage: {'count', 'p50', ...}} of successful stage durations, in SQL.
+
+    Each percentile is a single indexed ORDER BY ... LIMIT 1 OFFSET k
+    lookup (nearest rank), which works the same on SQLite and Postgres.
+    """
+    ok = [ReelStageEvent.status == 'ok']
+    if since is not None:
+        ok.append(ReelStageEvent.started_at >= since)
+    counts = db.session.execute(
+        select(ReelStageEvent.stage, func.count()).where(*ok).group_by(ReelStageEvent.stage)
+    ).all()
+    result = {}
+    for stage, count in counts:
+        result[stage] = {'count': count}
+        for percentile in percentiles:
+            rank = max(math.ceil(percentile / 100 * count) - 1, 0)
+            result[stage][f'p{percentile}'] = db.session.execute(
+                select(ReelStageEvent.duration_seconds)
+                .where(ReelStageEvent.stage == stage, *ok)
+                .order_by(ReelStageEvent.duration_seconds)
+                .limit(1).offset(rank)
+            ).scalar()
+    return result
+
+
+# Columns the gallery renders; descriptions are cut down in SQL to what a card shows
+GALLERY_COLUMNS = (
+    Reel.id, Reel.reel_id, Reel.title, func.substr(Reel.description, 1, 51).label('description'),
+    Reel.video_url, Reel.thumbnail_url, Reel.preview_url, Reel.duration_seconds,
+    Reel.status, Reel.created_at,
+)
+
+
+# Columns a status poll returns
+STATUS_COLUMNS = (
+    Reel.reel_id, Reel.status, Reel.video_url, Reel.thumbnail_url, Reel.preview_url,
+    Reel.duration_seconds,
+)
+
+
+def reel_statuses(reel_ids):
+    """{reel_id: compact status dict} for the given reel ids (unknown ids are left out)"""
+    rows = db.session.execute(select(*STATUS_COLUMNS).where(Reel.reel_id.in_(reel_ids))).all()
+    return {
+        row.reel_id: {
+            'status': row.status,
+            'video_url': row.video_url,
+            'thumbnail_url': row.thumbnail_url,
+            'preview_url': row.preview_url,
+            'duration': row.duration_seconds,
+        }
+        for row in rows
+    }
+
+
+def encode_cursor(row):
+    return f"{row.created_at.isoformat()}_{row.id}"
+
+
+def decode_cursor(cursor):
+    """(created_at, id) from a gallery cursor, or None if it is malformed"""
+    try:
+        created_at, reel_pk = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(created_at), int(reel_pk)
+    except (AttributeError, ValueError):
+        return None
+
+
+def gallery_page(before=None, limit=24, status=None):
+    """One page of reels, newest first, starting after the `before` cursor.
+
+    Keyset pagination: the page is found by seeking the (created_at, id)
+    index, so its cost doesn't grow with the number of older reels.
+    Returns (rows, cursor of the next page or None).
+    """
+    query = select(*GALLERY_COLUMNS).order_by(Reel.created_at.desc(), Reel.id.desc()).limit(limit + 1)
+    if status:
+        query = query.where(Reel.status == status)
+    position = decode_cursor(before) if before else None
+    if position:
+        created_at, reel_pk = position
+        # A row-value comparison, so the database seeks the index to the cursor
+        query = query.where(tuple_(Reel.created_at, Reel.id) < (created_at, reel_pk))
+    rows = db.session.execute(query).all()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def _apply_once(create, exists, attempts=3):
+    """Run a DDL step, tolerating another process running it at the same
+    time (the web app and its worker thread both upgrade the schema on
+    start). Returns False if the other side got there first."""
+    for attempt in range(attempts):
+        try:
+            create()
+            return True
+        except DatabaseError:
+            if exists():
+                return False
+            if attempt == attempts - 1:
+                raise
+            # Partly applied by the other side (e.g. one of several tables); retry
+            time.sleep(0.1)
+
+
+def upgrade_schema():
+    """Create missing tables, then add columns and indexes that were
+    introduced after an existing table was first created (create_all
+    never alters tables that already exist)."""
+    engine = db.engine
+    _apply_once(db.create_all, lambda: all(inspect(engine).has_table(t.name) for t in db.metadata.sorted_tables))
+    for table in db.metadata.sorted_tables:
+        columns = lambda: {column['name'] for column in inspect(engine).get_columns(table.name)}
+        indexes = lambda: {index['name'] for index in inspect(engine).get_indexes(table.name)}
+        existing = columns()
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}'
+            if column.server_default is not None:
+                ddl += f' DEFAULT {column.server_default.arg}'
+
+            def add_column(ddl=ddl):
+                with engine.begin() as conn:
+                    conn.execute(text(ddl))
+            if _apply_once(add_column, lambda name=column.name: name in columns()):
+                print(f"🛠️  Added column {table.name}.{column.name}")
+        for index in table.indexes:
+            _apply_once(lambda: index.create(bind=engine, checkfirst=True), lambda: index.name in indexes())
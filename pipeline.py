@@ -0,0 +1,135 @@
+"""A small staged pipeline for the background worker.
+
+Each stage owns a bounded queue and a pool of threads. A job moves through
+the stages in order, so while one reel is being encoded the next one can be
+synthesizing speech and the previous one uploading. Bounded queues give
+back-pressure: a slow stage fills its queue and the stages before it wait
+instead of piling up work.
+"""
+import logging
+import queue
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime
+
+from log_files import log_context
+from metrics import STAGE_SECONDS, STAGE_FAILURES, STAGE_BUSY_SECONDS, STAGE_BUSY, STAGE_WORKERS, STAGE_QUEUE
+
+logger = logging.getLogger(__name__)
+
+
+class StageError(Exception):
+    """Expected job failure (bad input, missing files); no traceback is logged"""
+
+
+class Stage:
+    def __init__(self, name, handler, workers, queue_size=None):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=queue_size or self.workers)
+
+
+class StagePipeline:
+    """Runs jobs through `stages`, calling on_done(job) or on_error(job, exc).
+
+    `context` is an optional callable returning a context manager entered by
+    every stage thread (e.g. `app.app_context`). Callers reserve a slot with
+    acquire_slot() before taking on a job and then submit() it; the slot is
+    released once the job has passed `slot_stage` (default: the last stage)
+    or failed. `slots` caps the jobs holding one; by default it is what the
+    stages up to `slot_stage` and their queues can hold.
+
+    Records logged while a stage handles a job carry the stage name and the
+    job's `reel_id`, and each stage exports its timings, failures, busy
+    workers and queue depth to metrics. on_stage(job, stage_name,
+    started_at, finished_at, error), if given, is called after every stage
+    with UTC datetimes and the exception the stage raised (or None).
+    """
+
+    def __init__(self, stages, on_done, on_error, context=None, on_stage=None, slots=None, slot_stage=None):
+        self.stages = stages
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_stage = on_stage
+        self.context = context or nullcontext
+        names = [stage.name for stage in stages]
+        self._slot_index = names.index(slot_stage) if slot_stage else len(stages) - 1
+        if slots is None:
+            slots = sum(stage.workers + stage.queue.maxsize for stage in stages[:self._slot_index + 1])
+        self._slots = threading.BoundedSemaphore(slots)
+        self._threads = []
+
+    def start(self):
+        for index, stage in enumerate(self.stages):
+            STAGE_WORKERS.labels(stage.name).set(stage.workers)
+            STAGE_QUEUE.labels(stage.name).set_function(stage.queue.qsize)
+            for n in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._run_stage, args=(index,), name=f"{stage.name}-{n}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def acquire_slot(self, timeout=None):
+        return self._slots.acquire(timeout=timeout)
+
+    def release_slot(self):
+        self._slots.release()
+
+    def submit(self, job):
+        self.stages[0].queue.put(job)
+
+    def _run_stage(self, index):
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        with self.context():
+            while True:
+                job = stage.queue.get()
+                with log_context(stage=stage.name, reel_id=getattr(job, 'reel_id', None)):
+                    try:
+                        self._handle(stage, job)
+                    except Exception as e:
+                        STAGE_FAILURES.labels(stage.name).inc()
+                        if not isinstance(e, StageError):
+                            logger.exception("❌ Stage '%s' crashed", stage.name)
+                        self._finish(self.on_error, job, e, release=index <= self._slot_index)
+                        continue
+                    if next_stage is not None:
+                        next_stage.queue.put(job)
+                        if index == self._slot_index:
+                            self.release_slot()
+                    else:
+                        self._finish(self.on_done, job, release=index == self._slot_index)
+
+    def _handle(self, stage, job):
+        busy = STAGE_BUSY.labels(stage.name)
+        busy.inc()
+        started = time.perf_counter()
+        started_at = datetime.utcnow()
+        error = None
+        try:
+            stage.handler(job)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            busy.dec()
+            STAGE_SECONDS.labels(stage.name).observe(elapsed)
+            STAGE_BUSY_SECONDS.labels(stage.name).inc(elapsed)
+            if self.on_stage:
+                try:
+                    self.on_stage(job, stage.name, started_at, datetime.utcnow(), error)
+                except Exception:
+                    logger.exception("on_stage callback failed")
+
+    def _finish(self, callback, job, *args, release=True):
+        try:
+            callback(job, *args)
+        except Exception:
+            logger.exception("Pipeline callback failed")
+        finally:
+            if release:
+                self.release_slot()
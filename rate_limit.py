@@ -0,0 +1,156 @@
+"""Client-side budgeting of calls to ElevenLabs and Cloudinary.
+
+Every outbound call takes a slot from its provider's RateLimiter first:
+
+- a token bucket caps the request rate. Its state (tokens left, current
+  rate) lives in a small file under VIDSNAP_RATE_LIMIT_DIR that is updated
+  under an exclusive file lock, so all workers on the host share one budget.
+  A caller that finds the bucket empty reserves the next token and sleeps
+  until it is due, so waiting callers are served in order without polling.
+- at most `max_in_flight` calls run at once, counted with one lock file per
+  slot. The operating system releases a slot's lock when its holder exits,
+  so a crashed worker never leaks capacity.
+
+When the provider answers 429 anyway, throttled() halves the rate (and, with
+a Retry-After, holds every caller back for that long); the rate then climbs
+back linearly to the configured one over `recovery_seconds`. The limiter
+settles just under the real quota instead of bursting into it.
+
+Without fcntl (Windows) the limits hold per process only.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - the app is deployed on Linux
+    fcntl = None
+
+from config import (RATE_LIMIT_DIR, ELEVENLABS_RATE, ELEVENLABS_MAX_IN_FLIGHT,
+                    CLOUDINARY_RATE, CLOUDINARY_MAX_IN_FLIGHT)
+from metrics import RATE_LIMIT_WAIT_SECONDS, RATE_LIMITED
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Up to `rate` calls per second (bursts of `burst`) and `max_in_flight`
+    concurrent calls to one provider; 0 turns either limit off"""
+
+    def __init__(self, name, rate, max_in_flight, burst=None, recovery_seconds=60, directory=RATE_LIMIT_DIR):
+        self.name = name
+        self.rate = rate
+        self.max_in_flight = max_in_flight
+        self.burst = burst or max(1.0, rate)
+        self.recovery_seconds = recovery_seconds
+        self.directory = directory
+        self._state_path = os.path.join(directory, f"{name}.json")
+        self._lock = threading.Lock()  # only used without fcntl
+        self._slots = threading.BoundedSemaphore(max_in_flight) if max_in_flight and fcntl is None else None
+        if rate or max_in_flight:
+            os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def slot(self):
+        """Hold one call's worth of budget: an in-flight slot and a token"""
+        started = time.monotonic()
+        with self._in_flight():
+            self._take_token()
+            RATE_LIMIT_WAIT_SECONDS.labels(self.name).observe(time.monotonic() - started)
+            yield
+
+    def throttled(self, retry_after=0):
+        """The provider rejected a call as over its limit: slow everyone down"""
+        RATE_LIMITED.labels(self.name).inc()
+        if not self.rate:
+            return
+        with self._state() as state:
+            state['rate'] = max(self.rate / 20, state['rate'] / 2)
+            if retry_after:
+                # Nobody gets a token until the provider's pause is over
+                state['tokens'] = min(state['tokens'], -retry_after * state['rate'])
+        logger.warning("🐢 %s rate limited; slowing to %.2f requests/s", self.name, state['rate'])
+
+    def _take_token(self):
+        if not self.rate:
+            return
+        with self._state() as state:
+            # Reserve a token even when none is left; the balance goes
+            # negative and the wait grows with every caller ahead of us
+            state['tokens'] -= 1
+            wait = -state['tokens'] / state['rate'] if state['tokens'] < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+    @contextmanager
+    def _state(self):
+        """The bucket, refilled up to now, for reading and updating under the lock"""
+        with self._locked_file(self._state_path) as f:
+            try:
+                state = json.loads(f.read() or '{}')
+            except ValueError:
+                state = {}
+            now = time.time()
+            rate = state.get('rate', self.rate)
+            elapsed = max(0.0, now - state.get('updated', now))
+            rate = min(self.rate, rate + self.rate * elapsed / self.recovery_seconds)
+            state = {
+                'rate': rate,
+                'tokens': min(self.burst, state.get('tokens', self.burst) + elapsed * rate),
+                'updated': now,
+            }
+            yield state
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+
+    @contextmanager
+    def _locked_file(self, path):
+        if fcntl is None:
+            with self._lock, open(path, 'a+') as f:
+                f.seek(0)
+                yield f
+            return
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield f  # closing the file releases the lock
+
+    @contextmanager
+    def _in_flight(self):
+        if not self.max_in_flight:
+            yield
+        elif self._slots is not None:
+            with self._slots:
+                yield
+        else:
+            f = self._claim_slot()
+            try:
+                yield
+            finally:
+                f.close()
+
+    def _claim_slot(self):
+        delay = 0.01
+        while True:
+            # Start at a random slot so callers don't all contend for slot 0
+            first = random.randrange(self.max_in_flight)
+            for i in range(self.max_in_flight):
+                path = os.path.join(self.directory, f"{self.name}.slot{(first + i) % self.max_in_flight}")
+                f = open(path, 'a')
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return f
+                except BlockingIOError:
+                    f.close()
+            time.sleep(delay)
+            delay = min(delay * 2, 0.25)
+
+
+ELEVENLABS_LIMIT = RateLimiter("elevenlabs", ELEVENLABS_RATE, ELEVENLABS_MAX_IN_FLIGHT)
+CLOUDINARY_LIMIT = RateLimiter("cloudinary", CLOUDINARY_RATE, CLOUDINARY_MAX_IN_FLIGHT)
@@ -0,0 +1,269 @@
+"""ffmpeg rendering of a reel: every uploaded image as a slideshow over the narration.
+
+The whole slideshow is one ffmpeg run with one filter graph. Each image is
+decoded, scaled and padded to the canvas once, then repeated with the
+`loop` filter for its share of the audio, instead of being re-decoded for
+every output frame. The clips are joined with `concat` or a chain of
+`xfade` crossfades, so encode time grows with the video's length, not
+with the number of images.
+
+Encoder settings come from named profiles (RENDER_PROFILES). Slides with
+hard cuts are still frames, so without crossfades a profile can encode at
+its much lower `still_fps`: the output stays a regular constant-frame-rate
+H.264/AAC MP4, just with far fewer frames to encode.
+
+The same run can also write a poster frame and a small, silent, sped-up
+preview clip for the gallery: the slideshow stream is split three ways
+inside the filter graph, so the images are only decoded once.
+
+Finished renders are kept in a disk cache keyed by a fingerprint of
+everything that determines the output (image and audio hashes, profile
+settings, canvas and ffmpeg version). Rendering identical inputs again,
+e.g. when a failed reel is retried, hard-links the cached files into place
+instead of encoding.
+"""
+import functools
+import glob
+import json
+import math
+import os
+import re
+import subprocess
+import time
+
+from config import CROSSFADE_SECONDS, FFMPEG_THREADS, RENDER_PROFILE, RENDER_CACHE_DIR, RENDER_CACHE_MAX_BYTES
+from disk_cache import DiskLRUCache, cache_key, file_digest
+from metrics import track_cache
+
+WIDTH = 1080
+HEIGHT = 1920
+FPS = 30
+IMAGE_EXTENSIONS = ("jpg", "jpeg", "png", "gif")
+
+# preset/crf: libx264 speed vs. quality; fps: frame rate with crossfades;
+# still_fps: frame rate with hard cuts; gop_seconds: keyframe interval;
+# crossfade (optional): overrides VIDSNAP_CROSSFADE_SECONDS
+RENDER_PROFILES = {
+    'fast-preview': {'preset': 'ultrafast', 'crf': 30, 'fps': 15, 'still_fps': 2, 'gop_seconds': 10, 'audio_bitrate': '96k', 'crossfade': 0},
+    'standard': {'preset': 'veryfast', 'crf': 23, 'fps': 30, 'still_fps': 5, 'gop_seconds': 5, 'audio_bitrate': '128k'},
+    'archive': {'preset': 'slow', 'crf': 18, 'fps': 30, 'still_fps': 30, 'gop_seconds': 2, 'audio_bitrate': '192k'},
+}
+
+# Gallery poster (JPEG, or WebP if the path ends in .webp) and preview clip
+POSTER_WIDTH = 540
+PREVIEW_WIDTH = 270
+PREVIEW_SECONDS = 4
+PREVIEW_FPS = 10
+
+# Bump when the filter graph or encoder flags change in ways the key doesn't capture
+RENDER_CACHE_VERSION = 1
+render_cache = DiskLRUCache(RENDER_CACHE_DIR, RENDER_CACHE_MAX_BYTES)
+track_cache("render", render_cache)
+
+
+class RenderError(Exception):
+    def __init__(self, message, returncode=None):
+        super().__init__(message)
+        self.returncode = returncode
+
+
+def find_images(folder):
+    """Images in upload order: 1.jpg, 2.jpg, ..., 10.jpg (numbers compared numerically)"""
+    paths = []
+    for ext in IMAGE_EXTENSIONS:
+        paths += glob.glob(os.path.join(folder, f"*.{ext}"))
+    natural = lambda path: [int(part) if part.isdigit() else part.lower()
+                            for part in re.split(r'(\d+)', os.path.basename(path))]
+    return sorted(paths, key=natural)
+
+
+def probe_duration(path):
+    """Media duration in seconds, via ffprobe or, if that is missing, ffmpeg's banner"""
+    try:
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+             '-of', 'default=noprint_wrappers=1:nokey=1', path],
+            capture_output=True, text=True, check=True,
+        )
+        return float(result.stdout.strip())
+    except (FileNotFoundError, ValueError, subprocess.CalledProcessError):
+        result = subprocess.run(['ffmpeg', '-hide_banner', '-i', path], capture_output=True, text=True)
+        match = re.search(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)', result.stderr)
+        if not match:
+            raise RenderError(f"Could not read the duration of {path}")
+        hours, minutes, seconds = match.groups()
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def slideshow_filter(count, duration, crossfade=CROSSFADE_SECONDS, width=WIDTH, height=HEIGHT, fps=FPS):
+    """Filter graph turning inputs 0..count-1 into one [vout] lasting `duration`"""
+    # Crossfades overlap neighbouring clips, so each clip is that much longer
+    crossfade = min(crossfade, duration / count / 2) if count > 1 else 0
+    clip = (duration + (count - 1) * crossfade) / count
+    frames = max(math.ceil(clip * fps), 1)
+
+    parts = []
+    for i in range(count):
+        parts.append(
+            f"[{i}:v]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2:black,setsar=1,format=yuv420p,"
+            f"loop=loop={frames - 1}:size=1:start=0,settb=1/{fps},setpts=N,fps={fps}[v{i}]"
+        )
+
+    if count == 1:
+        parts.append("[v0]null[vout]")
+    elif crossfade > 0:
+        previous = "v0"
+        for i in range(1, count):
+            label = "vout" if i == count - 1 else f"x{i}"
+            offset = i * (clip - crossfade)
+            parts.append(f"[{previous}][v{i}]xfade=transition=fade:duration={crossfade:.3f}:offset={offset:.3f}[{label}]")
+            previous = label
+    else:
+        parts.append("".join(f"[v{i}]" for i in range(count)) + f"concat=n={count}:v=1:a=0[vout]")
+    return ";".join(parts)
+
+
+def get_profile(name=None):
+    """Settings for a named profile (default: VIDSNAP_RENDER_PROFILE)"""
+    name = name or RENDER_PROFILE
+    if name not in RENDER_PROFILES:
+        raise RenderError(f"Unknown render profile '{name}' (choose from {', '.join(RENDER_PROFILES)})")
+    return dict(RENDER_PROFILES[name], name=name)
+
+
+def extras_filter(duration, poster=True, preview=True):
+    """Filter graph splitting [vout] into [vmain] plus [poster] and/or [preview]"""
+    outputs = ["vmain"] + (["vposter"] if poster else []) + (["vpreview"] if preview else [])
+    parts = ["[vout]split=" + str(len(outputs)) + "".join(f"[{label}]" for label in outputs)]
+    if poster:
+        parts.append(f"[vposter]trim=end_frame=1,scale={POSTER_WIDTH}:-2[poster]")
+    if preview:
+        # The whole slideshow, sped up to at most PREVIEW_SECONDS
+        speed = min(PREVIEW_SECONDS / duration, 1) if duration else 1
+        parts.append(f"[vpreview]setpts=PTS*{speed:.6f},fps={PREVIEW_FPS},scale={PREVIEW_WIDTH}:-2[preview]")
+    return ";".join(parts)
+
+
+def build_slideshow_command(images, audio_path, output_path, duration, crossfade=CROSSFADE_SECONDS,
+                            profile=None, threads=FFMPEG_THREADS, poster_path=None, preview_path=None):
+    profile = get_profile(profile)
+    crossfade = profile.get('crossfade', crossfade)
+    fps = profile['fps'] if crossfade > 0 and len(images) > 1 else profile['still_fps']
+    graph = slideshow_filter(len(images), duration, crossfade, fps=fps)
+    video = '[vout]'
+    if poster_path or preview_path:
+        graph += ";" + extras_filter(duration, bool(poster_path), bool(preview_path))
+        video = '[vmain]'
+    cmd = ['ffmpeg', '-y', '-v', 'error']
+    for image in images:
+        cmd += ['-i', image]
+    cmd += ['-i', audio_path]
+    cmd += [
+        '-filter_complex', graph,
+        '-map', video,
+        '-map', f'{len(images)}:a',
+        '-c:v', 'libx264',
+        '-preset', profile['preset'],
+        '-crf', str(profile['crf']),
+        '-tune', 'stillimage',
+        '-g', str(max(int(profile['gop_seconds'] * fps), 1)),
+        '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac',
+        '-b:a', profile['audio_bitrate'],
+        '-threads', str(threads),
+        '-t', f'{duration:.3f}',
+        '-movflags', '+faststart',
+        output_path,
+    ]
+    if poster_path:
+        cmd += ['-map', '[poster]', '-frames:v', '1']
+        cmd += ['-c:v', 'libwebp', '-quality', '80'] if poster_path.endswith('.webp') else ['-q:v', '4']
+        cmd += [poster_path]
+    if preview_path:
+        cmd += [
+            '-map', '[preview]', '-an',
+            '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '32', '-pix_fmt', 'yuv420p',
+            '-threads', str(threads), '-movflags', '+faststart',
+            preview_path,
+        ]
+    return cmd
+
+
+@functools.lru_cache(maxsize=1)
+def ffmpeg_version():
+    result = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True)
+    return result.stdout.split('\n', 1)[0]
+
+
+def render_fingerprint(images, audio_path, crossfade, profile, poster_path, preview_path):
+    """Cache key covering every input that changes the rendered files"""
+    return cache_key(
+        'render', RENDER_CACHE_VERSION, ffmpeg_version(),
+        [file_digest(image) for image in images], file_digest(audio_path),
+        get_profile(profile), crossfade, WIDTH, HEIGHT,
+        bool(poster_path) and (os.path.splitext(poster_path)[1], POSTER_WIDTH),
+        bool(preview_path) and (PREVIEW_WIDTH, PREVIEW_SECONDS, PREVIEW_FPS),
+    )
+
+
+def _cached_outputs(key, output_path, poster_path, preview_path):
+    """{cache entry: destination} for every file one render writes"""
+    outputs = {f"{key}.mp4": output_path}
+    if poster_path:
+        outputs[f"{key}-poster{os.path.splitext(poster_path)[1]}"] = poster_path
+    if preview_path:
+        outputs[f"{key}-preview.mp4"] = preview_path
+    return outputs
+
+
+def render_slideshow(images, audio_path, output_path, crossfade=CROSSFADE_SECONDS, profile=None,
+                     poster_path=None, preview_path=None, cache=render_cache):
+    """Render `images` over `audio_path` into output_path in a single encode.
+
+    poster_path and preview_path, if given, are written by the same ffmpeg run.
+    Identical inputs are served from `cache` (None to always encode).
+    Returns the profile used, the video's duration, the encode wall time,
+    the output size and whether the render came from the cache.
+    """
+    if not images:
+        raise RenderError("No images found")
+    profile = get_profile(profile)['name']
+    started = time.perf_counter()
+    use_cache = cache is not None and cache.max_bytes > 0
+    if use_cache:
+        key = render_fingerprint(images, audio_path, crossfade, profile, poster_path, preview_path)
+        outputs = _cached_outputs(key, output_path, poster_path, preview_path)
+        # The metadata entry is written last, so its presence marks a complete render
+        meta = cache.read(f"{key}.json", count=False)
+        hit = meta is not None and all(cache.get(entry, dest, count=False) for entry, dest in outputs.items())
+        cache.record_lookup(hit)
+        if hit:
+            stats = json.loads(meta)
+            return dict(stats, encode_seconds=round(time.perf_counter() - started, 3), cached=True)
+
+    # Outputs may be hard links into the cache; unlink them so ffmpeg writes new files
+    for path in (output_path, poster_path, preview_path):
+        if path and os.path.exists(path):
+            os.remove(path)
+    duration = probe_duration(audio_path)
+    result = subprocess.run(
+        build_slideshow_command(images, audio_path, output_path, duration, crossfade, profile,
+                                poster_path=poster_path, preview_path=preview_path),
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RenderError(f"FFmpeg error: {result.stderr[-2000:]}", result.returncode)
+    stats = {
+        'profile': profile,
+        'duration': round(duration, 3),
+        'encode_seconds': round(time.perf_counter() - started, 3),
+        'output_bytes': os.path.getsize(output_path),
+        'cached': False,
+    }
+    if use_cache:
+        for entry, src in outputs.items():
+            # Safe to link: outputs are unlinked, never rewritten, before a render
+            cache.put(entry, src, link=True)
+        cache.write(f"{key}.json", json.dumps(stats).encode('utf-8'))
+    return stats
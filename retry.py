@@ -0,0 +1,88 @@
+"""Retry policies: which failures are worth another try, and when.
+
+Provider hiccups (a 429 from ElevenLabs, a Cloudinary 5xx, a timeout) are
+transient; bad input is not and is never retried. A RetryPolicy is used at
+two levels:
+
+- around a single provider call (RetryPolicy.call), with short delays, so a
+  brief rate limit doesn't fail the stage at all;
+- for the reel as a whole, by the worker: a reel whose stage failed with a
+  transient error goes back into the queue with `next_attempt_at` pushed
+  out by the policy's delay, until its attempts run out and it is moved to
+  the 'dead' status with its last error.
+
+Delays grow exponentially and are jittered so that reels which failed
+together don't all come back at the same moment.
+"""
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses a provider may answer differently a little later
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+class TransientError(Exception):
+    """A failure worth retrying later: rate limits, provider 5xx, timeouts"""
+
+
+def is_transient(error):
+    if isinstance(error, (TransientError, TimeoutError, ConnectionError)):
+        return True
+    # HTTP client errors (ElevenLabs' ApiError, httpx) carry the status
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status in RETRYABLE_STATUS
+
+
+def retry_after(error):
+    """Seconds the provider asked us to wait (a Retry-After header), or 0"""
+    headers = getattr(error, 'headers', None) or getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after') or headers.get('Retry-After') or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class RetryPolicy:
+    """Up to `attempts` tries, waiting about base_seconds * 2**n between them
+    (capped at max_seconds) when retry_on(error) says the error is transient"""
+
+    def __init__(self, attempts, base_seconds, max_seconds, retry_on=is_transient):
+        self.attempts = attempts
+        self.base_seconds = base_seconds
+        self.max_seconds = max_seconds
+        self.retry_on = retry_on
+
+    def should_retry(self, error, attempt):
+        """Whether to try again after `error` ended try number `attempt` (from 1)"""
+        return attempt < self.attempts and self.retry_on(error)
+
+    def delay(self, attempt, error=None):
+        """Seconds to wait after try number `attempt`: half fixed, half random"""
+        ceiling = min(self.max_seconds, self.base_seconds * 2 ** (attempt - 1))
+        delay = ceiling / 2 + random.uniform(0, ceiling / 2)
+        if error is not None:
+            delay = max(delay, min(retry_after(error), self.max_seconds))
+        return delay
+
+    def call(self, function, *args, **kwargs):
+        """Call function, retrying transient errors; the last error is raised"""
+        attempt = 1
+        while True:
+            try:
+                return function(*args, **kwargs)
+            except Exception as e:
+                if not self.should_retry(e, attempt):
+                    raise
+                delay = self.delay(attempt, e)
+                logger.warning("🔁 %s failed (%s); retry %d/%d in %.1fs",
+                               getattr(function, '__name__', 'call'), e, attempt, self.attempts - 1, delay)
+                time.sleep(delay)
+                attempt += 1
+
+
+NO_RETRY = RetryPolicy(1, 0, 0)
@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+
+from job_queue import claim_next_reel, claim_order, finish_reel
+from models import db, Reel
+
+NOW = datetime(2026, 1, 1, 12, 0, 0)
+
+
+def queue(submitter, count=1, minutes_ago=0, priority=0):
+    created_at = NOW - timedelta(minutes=minutes_ago)
+    reels = [
+        Reel(reel_id=f"{submitter}-{minutes_ago}-{priority}-{i}", title='t', description='d',
+             submitter=submitter, priority=priority,
+             # Keep queueing order stable within a batch
+             created_at=created_at + timedelta(microseconds=i), updated_at=created_at)
+        for i in range(count)
+    ]
+    db.session.add_all(reels)
+    db.session.commit()
+    return reels
+
+
+def order(now=NOW):
+    ids = db.session.execute(claim_order(now)).scalars().all()
+    return [db.session.get(Reel, reel_id).reel_id for reel_id in ids]
+
+
+def test_submitters_take_turns(app):
+    queue('a', 3, minutes_ago=3)
+    queue('b', 2, minutes_ago=2)
+    queue('c', 1, minutes_ago=1)
+
+    assert order() == ['a-3-0-0', 'b-2-0-0', 'c-1-0-0', 'a-3-0-1', 'b-2-0-1', 'a-3-0-2']
+
+
+def test_old_backlog_does_not_starve_a_new_submitter(app):
+    queue('bulk', 200, minutes_ago=20)
+    queue('someone', 1)
+
+    assert order().index('someone-0-0-0') <= 1
+
+
+def test_new_submitter_stays_ahead_after_bulk_reel_finishes(app):
+    queue('bulk', 200, minutes_ago=20)
+    queue('someone', 1)
+
+    reel = claim_next_reel('worker')
+    finish_reel(reel.id, 'worker', status='completed')
+
+    assert order(datetime.utcnow())[0] == 'someone-0-0-0'
+
+
+def test_low_priority_rises_one_step_per_aging_period(app):
+    queue('batch', 1, minutes_ago=16, priority=-2)
+    queue('someone', 1)
+    assert order()[0] == 'someone-0-0-0'
+
+    db.session.query(Reel).filter_by(submitter='batch').update(
+        {Reel.created_at: NOW - timedelta(minutes=31)})
+    db.session.commit()
+    # Aged back to priority 0, it keeps its turn rather than jumping ahead
+    assert order() == ['batch-16--2-0', 'someone-0-0-0']
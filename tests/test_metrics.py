@@ -0,0 +1,17 @@
+from metrics import Gauge, Histogram, Registry
+
+
+def test_failing_callback_skips_only_its_sample():
+    registry = Registry()
+    gauge = Gauge('vidsnap_test_depth', 'Test gauge', ['queue'], registry=registry)
+    gauge.labels('ok').set(3)
+    gauge.labels('broken').set_function(lambda: 1 / 0)
+    gauge.labels('odd').set_function(lambda: None)
+    Histogram('vidsnap_test_seconds', 'Test histogram', buckets=(1,), registry=registry).observe(0.5)
+
+    text = registry.exposition()
+
+    assert 'vidsnap_test_depth{queue="ok"} 3' in text
+    assert 'broken' not in text
+    assert 'odd' not in text
+    assert 'vidsnap_test_seconds_count 1' in text
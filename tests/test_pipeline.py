@@ -0,0 +1,60 @@
+import threading
+from datetime import datetime, timedelta
+
+from job_queue import claim_next_reel
+from models import db, Reel
+from pipeline import Stage, StagePipeline
+
+
+def queue(submitter, count, created_at):
+    db.session.add_all(
+        Reel(reel_id=f"{submitter}-{i}", title='t', description='d', submitter=submitter,
+             created_at=created_at + timedelta(microseconds=i))
+        for i in range(count)
+    )
+    db.session.commit()
+
+
+def claim_while_room(pipeline, worker_id):
+    """The worker's claim loop, stopping instead of waiting when it is full"""
+    claimed = []
+    while pipeline.acquire_slot(timeout=0.2):
+        reel = claim_next_reel(worker_id)
+        if reel is None:
+            pipeline.release_slot()
+            break
+        claimed.append(reel.reel_id)
+        pipeline.submit(reel.reel_id)
+    return claimed
+
+
+def test_new_submitter_waits_behind_at_most_one_claimed_reel(app):
+    rendered = []
+    render_gate = threading.Semaphore(0)
+    done = threading.Semaphore(0)
+
+    def render(reel_id):
+        render_gate.acquire()
+        rendered.append(reel_id)
+
+    pipeline = StagePipeline(
+        [Stage('ingest', lambda job: None, 1), Stage('tts', lambda job: None, 4),
+         Stage('render', render, 1), Stage('upload', lambda job: None, 4)],
+        on_done=lambda job: done.release(),
+        on_error=lambda job, e: done.release(),
+        slots=2, slot_stage='render',
+    )
+    pipeline.start()
+    queue('bulk', 40, datetime.utcnow() - timedelta(minutes=5))
+
+    assert claim_while_room(pipeline, 'worker') == ['bulk-0', 'bulk-1']
+
+    queue('someone', 1, datetime.utcnow())
+    render_gate.release()
+    assert claim_while_room(pipeline, 'worker') == ['someone-0']
+
+    render_gate.release()
+    render_gate.release()
+    for _ in range(3):
+        assert done.acquire(timeout=5)
+    assert rendered == ['bulk-0', 'bulk-1', 'someone-0']
@@ -0,0 +1,51 @@
+import io
+
+import pytest
+from flask import Flask, request
+
+from uploads import UploadRejected, UploadRequest
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\0' * 32
+
+
+@pytest.fixture
+def upload_app(tmp_path):
+    app = Flask(__name__)
+    app.request_class = UploadRequest
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+
+    @app.route('/upload', methods=['POST'])
+    def upload():
+        for file in request.files.values():
+            file.stream.save_as(str(tmp_path / file.filename))
+        return {'form': dict(request.form), 'files': sorted(request.files)}
+
+    @app.errorhandler(UploadRejected)
+    def rejected(e):
+        return {'error': e.description}, e.code
+
+    return app
+
+
+def post(app, filename, content):
+    return app.test_client().post('/upload', data={'uuid': 'x', 'file1': (io.BytesIO(content), filename)},
+                                  content_type='multipart/form-data')
+
+
+def test_image_is_moved_into_place(upload_app, tmp_path):
+    response = post(upload_app, 'a.png', PNG)
+
+    assert response.status_code == 200
+    assert (tmp_path / 'a.png').read_bytes() == PNG
+
+
+def test_file_too_short_to_identify_is_rejected_while_parsing(upload_app, tmp_path):
+    response = post(upload_app, 'a.jpg', b'ab')
+
+    assert response.status_code == 400
+    assert not (tmp_path / 'a.jpg').exists()
+    assert list((tmp_path / '.incoming').iterdir()) == []
+
+
+def test_unknown_content_is_rejected(upload_app):
+    assert post(upload_app, 'a.png', b'not an image at all').status_code == 400
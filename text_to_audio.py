@@ -1,53 +1,103 @@
 
 import os
-import uuid
-from elevenlabs import VoiceSettings
-from elevenlabs.client import ElevenLabs
-from config import ELEVENLABS_API_KEY
+import re
+from concurrent.futures import ThreadPoolExecutor
+from config import TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES, TTS_CHUNK_CHARS, TTS_CHUNK_CONCURRENCY
+from disk_cache import DiskLRUCache, cache_key
+from metrics import track_cache
+from retry import RetryPolicy
+from tts_backends import get_backend, get_fallback_backend
 from dotenv import load_dotenv
 load_dotenv()
 
-elevenlabs = ElevenLabs(
-    api_key=ELEVENLABS_API_KEY,
-)
+# Synthesized MP3s keyed by everything that affects the audio, so repeated
+# or retried reels with the same description skip the API call
+tts_cache = DiskLRUCache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES, suffix=".mp3")
+track_cache("tts", tts_cache)
 
+# Rate limits and provider errors are retried briefly before falling back
+TTS_RETRY = RetryPolicy(attempts=3, base_seconds=1, max_seconds=15)
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+def split_into_chunks(text, max_chars=TTS_CHUNK_CHARS):
+    """Group whole sentences into chunks of at most max_chars.
+
+    A single sentence longer than max_chars becomes its own chunk.
+    """
+    chunks = []
+    current = ""
+    for sentence in SENTENCE_END.split(text.strip()):
+        if not sentence:
+            continue
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def synthesize_chunk(chunks, index, backend):
+    """Return the MP3 bytes for chunks[index], from the cache when possible.
+
+    Falls back to VIDSNAP_TTS_FALLBACK if the backend fails; the fallback's
+    audio is cached under its own key, so the primary is tried again next time.
+    """
+    text = chunks[index]
+    previous_text = chunks[index - 1] if index > 0 else None
+    next_text = chunks[index + 1] if index + 1 < len(chunks) else None
+
+    def cached(engine):
+        key = cache_key(text, *engine.cache_params())
+        if len(chunks) > 1:
+            key = cache_key(key, previous_text, next_text)
+        audio = tts_cache.read(key)
+        if audio is None:
+            audio = TTS_RETRY.call(engine.synthesize, text, previous_text, next_text)
+            tts_cache.write(key, audio)
+        return audio
 
-def text_to_speech_file(text: str,folder:str) -> str:
     try:
-        # Calling the text_to_speech conversion API with detailed parameters
-        response = elevenlabs.text_to_speech.convert(
-            voice_id="pNInz6obpgDQGcFmaJgB", # Adam pre-made voice
-            output_format="mp3_22050_32",
-            text=text,
-            model_id="eleven_turbo_v2_5", # use the turbo model for low latency
-            # Optional voice settings that allow you to customize the output
-            voice_settings=VoiceSettings(
-                stability=0.0,
-                similarity_boost=1.0,
-                style=0.0,
-                use_speaker_boost=True,
-                speed=1.0,
-            ),
-        )
+        return cached(backend)
     except Exception as api_err:
-        print(f"🔥 ElevenLabs API Error: {api_err}")
-        import traceback
-        traceback.print_exc()
-        raise api_err
+        fallback = get_fallback_backend(backend)
+        if fallback is None:
+            raise
+        print(f"⚠️  {backend.name} TTS failed ({api_err}); using {fallback.name}")
+        return cached(fallback)
 
-    # uncomment the line below to play the audio back
-    # play(response)
 
+def text_to_speech_file(text: str,folder:str,backend:str=None) -> str:
+    """Synthesize `text` into user_uploads/<folder>/audio.mp3.
+
+    The text is split at sentence boundaries and the chunks are synthesized
+    concurrently (VIDSNAP_TTS_CHUNK_CONCURRENCY at a time); segments are
+    appended to the file in order as soon as each is ready, so the total
+    time approaches that of the slowest chunk instead of the sum.
+    """
+    engine = get_backend(backend)
     # Generating a unique file name for the output MP3 file
     save_file_path = os.path.join(f"user_uploads/{folder}","audio.mp3")
+    chunks = split_into_chunks(text) or [text]
 
-    # Writing the audio to a file
-    with open(save_file_path, "wb") as f:
-        for chunk in response:
-            if chunk:
-                f.write(chunk)
+    try:
+        with ThreadPoolExecutor(max_workers=min(TTS_CHUNK_CONCURRENCY, len(chunks))) as pool:
+            segments = [pool.submit(synthesize_chunk, chunks, i, engine) for i in range(len(chunks))]
+            # Writing the audio to a file
+            with open(save_file_path, "wb") as f:
+                for segment in segments:
+                    f.write(segment.result())
+    except Exception as api_err:
+        print(f"🔥 {engine.name} TTS Error: {api_err}")
+        import traceback
+        traceback.print_exc()
+        raise api_err
 
-    print(f"{save_file_path}: A new audio file was saved successfully!")
+    print(f"{save_file_path}: A new audio file was saved successfully! ({len(chunks)} chunk(s), cache {tts_cache.stats()})")
 
     # Return the path of the saved audio file
     return save_file_path
@@ -0,0 +1,171 @@
+"""Text-to-speech backends.
+
+Every backend turns one chunk of text into MP3 bytes (22.05 kHz mono, the
+same format ElevenLabs returns for "mp3_22050_32", so segments from any
+backend can be joined). Pick one with VIDSNAP_TTS_BACKEND:
+
+- "elevenlabs": the hosted API (default)
+- "local": an installed piper or espeak-ng/espeak binary, fully offline
+- "stub": deterministic silence or a tone, for load tests and benchmarks
+
+If VIDSNAP_TTS_FALLBACK names a second backend, it is used whenever the
+primary one fails or times out.
+"""
+import shutil
+import subprocess
+import threading
+import time
+
+from config import (ELEVENLABS_API_KEY, TTS_BACKEND, TTS_FALLBACK_BACKEND, TTS_TIMEOUT_SECONDS,
+                    LOCAL_TTS_VOICE, PIPER_MODEL, STUB_TTS_LATENCY, STUB_TTS_TONE_HZ)
+from rate_limit import ELEVENLABS_LIMIT
+from retry import TransientError, retry_after
+
+
+def encode_mp3(ffmpeg_input_args, stdin=None):
+    """Run ffmpeg on the given input and return 22.05 kHz mono 32 kbps MP3 bytes"""
+    result = subprocess.run(
+        ['ffmpeg', '-v', 'error', *ffmpeg_input_args,
+         '-ar', '22050', '-ac', '1', '-b:a', '32k', '-f', 'mp3', 'pipe:1'],
+        input=stdin, capture_output=True, check=True,
+    )
+    return result.stdout
+
+
+class TTSBackend:
+    name = None
+
+    def cache_params(self):
+        """Everything besides the text that changes the audio; part of the cache key"""
+        return (self.name,)
+
+    def synthesize(self, text, previous_text=None, next_text=None):
+        raise NotImplementedError
+
+
+class ElevenLabsBackend(TTSBackend):
+    name = "elevenlabs"
+    voice_id = "pNInz6obpgDQGcFmaJgB" # Adam pre-made voice
+    model_id = "eleven_turbo_v2_5" # use the turbo model for low latency
+    output_format = "mp3_22050_32"
+    # Optional voice settings that allow you to customize the output
+    voice_settings = {
+        "stability": 0.0,
+        "similarity_boost": 1.0,
+        "style": 0.0,
+        "use_speaker_boost": True,
+        "speed": 1.0,
+    }
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # Built on first use so importing the worker doesn't pay for it
+        with self._lock:
+            if self._client is None:
+                from elevenlabs.client import ElevenLabs
+                self._client = ElevenLabs(api_key=ELEVENLABS_API_KEY, timeout=TTS_TIMEOUT_SECONDS)
+            return self._client
+
+    def cache_params(self):
+        # Kept identical to the original cache key so existing entries stay valid
+        return (self.voice_id, self.model_id, self.output_format, self.voice_settings)
+
+    def synthesize(self, text, previous_text=None, next_text=None):
+        import httpx
+        from elevenlabs import VoiceSettings
+        # Neighbouring text keeps the prosody continuous across chunks
+        with ELEVENLABS_LIMIT.slot():
+            try:
+                response = self.client.text_to_speech.convert(
+                    voice_id=self.voice_id,
+                    output_format=self.output_format,
+                    text=text,
+                    model_id=self.model_id,
+                    voice_settings=VoiceSettings(**self.voice_settings),
+                    previous_text=previous_text,
+                    next_text=next_text,
+                )
+                return b"".join(chunk for chunk in response if chunk)
+            except httpx.TransportError as e:
+                # Timeouts and dropped connections; HTTP errors carry their status
+                raise TransientError(f"ElevenLabs request failed: {e!r}") from e
+            except Exception as e:
+                if getattr(e, 'status_code', None) == 429:
+                    ELEVENLABS_LIMIT.throttled(retry_after(e))
+                raise
+
+
+class LocalBackend(TTSBackend):
+    """Offline speech from piper (when VIDSNAP_PIPER_MODEL is set) or espeak-ng/espeak"""
+    name = "local"
+
+    def __init__(self):
+        if PIPER_MODEL and shutil.which("piper"):
+            self.engine = "piper"
+        else:
+            self.engine = shutil.which("espeak-ng") and "espeak-ng" or shutil.which("espeak") and "espeak"
+        if not self.engine:
+            raise RuntimeError("No local TTS engine found (install piper or espeak-ng)")
+
+    def cache_params(self):
+        return (self.name, self.engine, PIPER_MODEL if self.engine == "piper" else LOCAL_TTS_VOICE)
+
+    def synthesize(self, text, previous_text=None, next_text=None):
+        if self.engine == "piper":
+            cmd = ["piper", "--model", PIPER_MODEL, "--output_file", "-"]
+        else:
+            cmd = [self.engine, "-v", LOCAL_TTS_VOICE, "--stdout"]
+        wav = subprocess.run(cmd, input=text.encode("utf-8"), capture_output=True, check=True).stdout
+        return encode_mp3(["-f", "wav", "-i", "pipe:0"], stdin=wav)
+
+
+class StubBackend(TTSBackend):
+    """Deterministic audio lasting roughly as long as the text takes to read.
+
+    Silence by default, or a sine tone at VIDSNAP_STUB_TTS_TONE_HZ;
+    VIDSNAP_STUB_TTS_LATENCY adds a per-request delay to mimic the API.
+    """
+    name = "stub"
+
+    def cache_params(self):
+        return (self.name, STUB_TTS_TONE_HZ)
+
+    def synthesize(self, text, previous_text=None, next_text=None):
+        if STUB_TTS_LATENCY:
+            time.sleep(STUB_TTS_LATENCY)
+        seconds = max(len(text.split()) / 2.5, 0.5)  # ~150 words per minute
+        source = f"sine=frequency={STUB_TTS_TONE_HZ}" if STUB_TTS_TONE_HZ else "anullsrc=r=22050:cl=mono"
+        return encode_mp3(["-f", "lavfi", "-i", source, "-t", f"{seconds:.2f}"])
+
+
+BACKENDS = {
+    "elevenlabs": ElevenLabsBackend,
+    "local": LocalBackend,
+    "stub": StubBackend,
+    "fake": StubBackend,
+}
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_backend(name=None):
+    """Shared backend instance by name (default: VIDSNAP_TTS_BACKEND)"""
+    name = name or TTS_BACKEND
+    with _instances_lock:
+        if name not in _instances:
+            if name not in BACKENDS:
+                raise ValueError(f"Unknown TTS backend '{name}' (choose from {', '.join(BACKENDS)})")
+            _instances[name] = BACKENDS[name]()
+        return _instances[name]
+
+
+def get_fallback_backend(primary):
+    """The configured fallback, unless it is the primary backend itself"""
+    if not TTS_FALLBACK_BACKEND or BACKENDS.get(TTS_FALLBACK_BACKEND) is type(primary):
+        return None
+    return get_backend(TTS_FALLBACK_BACKEND)
@@ -0,0 +1,145 @@
+"""Streaming handling of multipart image uploads.
+
+Werkzeug normally spools each uploaded file into memory or a temp file
+and the view copies it again with `file.save`. UploadRequest instead
+hands the multipart parser a writer that streams every chunk straight
+into a staging file next to the upload folder, so memory stays flat and
+saving is a rename. Files are checked while they arrive: the extension
+before the first byte is written, the magic bytes as soon as the first
+chunk lands, and the size on every chunk. A failed check aborts parsing
+immediately, so the rest of the body is never written to disk. A part
+too short to identify is rejected when it ends, so by the time the view
+runs every file in request.files is a known image.
+"""
+import io
+import os
+import tempfile
+
+from flask import Request, current_app
+from werkzeug.exceptions import HTTPException
+
+from config import MAX_UPLOAD_FILE_BYTES
+
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+
+# Leading bytes of each accepted image format
+IMAGE_SIGNATURES = {
+    b'\xff\xd8\xff': 'jpeg',
+    b'\x89PNG\r\n\x1a\n': 'png',
+    b'GIF87a': 'gif',
+    b'GIF89a': 'gif',
+}
+SNIFF_BYTES = max(len(signature) for signature in IMAGE_SIGNATURES)
+
+
+class UploadRejected(HTTPException):
+    code = 400
+
+    def __init__(self, description, code=None):
+        super().__init__(description)
+        if code:
+            self.code = code
+
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def sniff_image(head):
+    for signature, kind in IMAGE_SIGNATURES.items():
+        if head.startswith(signature):
+            return kind
+    return None
+
+
+class StreamedUpload:
+    """Writable staging file that validates an upload chunk by chunk"""
+
+    def __init__(self, directory, filename, max_bytes=MAX_UPLOAD_FILE_BYTES):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.kind = None
+        self.finished = False
+        self._head = b''
+        fd, self.name = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        self._file = os.fdopen(fd, 'w+b')
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.discard()
+            raise UploadRejected(f"{self.filename} is larger than {self.max_bytes // (1024 * 1024)} MB", 413)
+        if self.kind is None and len(self._head) < SNIFF_BYTES:
+            self._head += data[:SNIFF_BYTES - len(self._head)]
+            self.kind = sniff_image(self._head)
+            if self.kind is None and len(self._head) >= SNIFF_BYTES:
+                self.discard()
+                raise UploadRejected(f"{self.filename} is not a PNG, JPEG or GIF image")
+        return self._file.write(data)
+
+    def read(self, *args):
+        return self._file.read(*args)
+
+    def readline(self, *args):
+        return self._file.readline(*args)
+
+    def seek(self, *args):
+        if not self.finished:
+            # The multipart parser rewinds each file part once it has ended
+            self.finish()
+        return self._file.seek(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def close(self):
+        self.discard()
+
+    def finish(self):
+        """Reject a completed part whose type was never recognised"""
+        self.finished = True
+        if self.kind is None:
+            self.discard()
+            raise UploadRejected(f"{self.filename} is not a PNG, JPEG or GIF image")
+
+    def save_as(self, destination):
+        """Move the staged upload into place; a rename, not a copy"""
+        self._file.close()
+        os.replace(self.name, destination)
+
+    def discard(self):
+        if not self._file.closed:
+            self._file.close()
+        try:
+            os.remove(self.name)
+        except FileNotFoundError:
+            pass
+
+
+class UploadRequest(Request):
+    """Flask request class that streams file parts through StreamedUpload.
+
+    The whole body is capped by the app's MAX_CONTENT_LENGTH; each file by
+    VIDSNAP_MAX_UPLOAD_FILE_MB. Staging files that are not moved into
+    place are deleted when the request closes.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if not filename:
+            # An empty file input: no content follows
+            return io.BytesIO()
+        if not allowed_file(filename):
+            raise UploadRejected("Invalid file type")
+        staging_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], '.incoming')
+        os.makedirs(staging_dir, exist_ok=True)
+        upload = StreamedUpload(staging_dir, filename)
+        self.__dict__.setdefault('_streamed_uploads', []).append(upload)
+        return upload
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            for upload in self.__dict__.get('_streamed_uploads', []):
+                upload.discard()